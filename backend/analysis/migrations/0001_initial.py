@@ -0,0 +1,31 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('exams', '0003_score_responses'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExamAnalyticsSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num_items', models.PositiveIntegerField(default=0)),
+                ('students', models.PositiveIntegerField(default=0)),
+                ('sum_totals', models.FloatField(default=0.0)),
+                ('sum_squares', models.FloatField(default=0.0)),
+                ('sum_percent', models.FloatField(default=0.0)),
+                ('item_correct', models.JSONField(default=list)),
+                ('item_total_sums', models.JSONField(default=list)),
+                ('discrimination', models.JSONField(default=list)),
+                ('discrimination_refreshed_at', models.DateTimeField(blank=True, null=True)),
+                ('changed_at', models.DateTimeField(blank=True, null=True)),
+                ('exam', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='analytics_snapshot', to='exams.exam')),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import models
+
+from exams.models import Exam
+
+
+class ExamAnalyticsSnapshot(models.Model):
+    """Running sufficient statistics for an exam's item analysis.
+
+    Maintained incrementally as scores are written so the dashboard can be
+    served in O(items). The discrimination index needs a ranking of all
+    examinees and is refreshed lazily; ``discrimination_refreshed_at`` older
+    than ``changed_at`` means it is stale.
+    """
+
+    exam = models.OneToOneField(Exam, on_delete=models.CASCADE, related_name='analytics_snapshot')
+    num_items = models.PositiveIntegerField(default=0)
+    students = models.PositiveIntegerField(default=0)
+    sum_totals = models.FloatField(default=0.0)
+    sum_squares = models.FloatField(default=0.0)
+    sum_percent = models.FloatField(default=0.0)
+    # Per item: number of correct answers, and the sum of the totals of the
+    # students who answered it correctly.
+    item_correct = models.JSONField(default=list)
+    item_total_sums = models.JSONField(default=list)
+    discrimination = models.JSONField(default=list)
+    discrimination_refreshed_at = models.DateTimeField(null=True, blank=True)
+    changed_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def discrimination_stale(self) -> bool:
+        if self.discrimination_refreshed_at is None:
+            return True
+        return self.changed_at is not None and self.changed_at > self.discrimination_refreshed_at
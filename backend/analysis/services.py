@@ -2,10 +2,20 @@ from __future__ import annotations
 
 import math
 from dataclasses import dataclass
-from statistics import mean, pstdev
-from typing import List
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 
 from exams.models import Exam
+from exams.responses import correctness_matrix, key_length
+from .models import ExamAnalyticsSnapshot
+
+# (set_code, responses, raw_score, percent) of one score.
+ScoreRow = Tuple[str, bytes, float, float]
 
 
 @dataclass
@@ -23,98 +33,209 @@ class ExamAnalytics:
     average_score: float
     average_percent: float
     item_stats: List[ItemAnalytics]
+    discrimination_refreshed_at: Optional[datetime] = None
+    discrimination_stale: bool = False
 
 
-def _difficulty(correct_counts: List[int], total_students: int) -> List[float]:
-    if total_students == 0:
-        return [0.0 for _ in correct_counts]
-    return [count / total_students for count in correct_counts]
-
-
-def _discrimination_index(item_matrix: List[List[bool]], totals: List[int]) -> List[float]:
-    if not totals:
-        return [0.0 for _ in range(len(item_matrix[0]) if item_matrix else 0)]
-    paired = list(zip(totals, item_matrix))
-    paired.sort(key=lambda x: x[0])
-    n = len(paired)
+def _discrimination_index(matrix: np.ndarray, totals: np.ndarray) -> np.ndarray:
+    n = matrix.shape[0]
+    if n == 0:
+        return np.zeros(matrix.shape[1])
     slice_size = max(1, math.floor(n * 0.27))
-    bottom = paired[:slice_size]
-    top = paired[-slice_size:]
-    results: List[float] = []
-    for idx in range(len(item_matrix[0])):
-        top_correct = sum(1 for _, answers in top if answers[idx])
-        bottom_correct = sum(1 for _, answers in bottom if answers[idx])
-        results.append(
-            (top_correct / slice_size if slice_size else 0) - (bottom_correct / slice_size if slice_size else 0)
-        )
-    return results
-
-
-def _point_biserial(item_matrix: List[List[bool]], totals: List[int]) -> List[float]:
-    if not totals:
-        return [0.0 for _ in range(len(item_matrix[0]) if item_matrix else 0)]
-    avg_total = mean(totals)
-    sd_total = pstdev(totals) or 1.0
-    n = len(totals)
-    results: List[float] = []
-    for idx in range(len(item_matrix[0])):
-        correct_totals = [totals[i] for i in range(n) if item_matrix[i][idx]]
-        incorrect_totals = [totals[i] for i in range(n) if not item_matrix[i][idx]]
-        p = len(correct_totals) / n if n else 0
-        q = 1 - p
-        if not correct_totals or not incorrect_totals or p in {0, 1}:
-            results.append(0.0)
-            continue
-        mean_correct = mean(correct_totals)
-        mean_incorrect = mean(incorrect_totals)
-        r_pb = ((mean_correct - mean_incorrect) / sd_total) * math.sqrt(p * q)
-        results.append(r_pb)
-    return results
-
-
-def compute_exam_analytics(exam: Exam) -> ExamAnalytics:
-    scores = list(exam.scores.all())
-    breakdowns = [score.breakdown for score in scores]
-    totals = [score.raw_score for score in scores]
-    if not breakdowns:
-        return ExamAnalytics(
-            exam_id=exam.id,
-            kr20=0.0,
-            average_score=0.0,
-            average_percent=0.0,
-            item_stats=[],
-        )
-
-    num_items = len(breakdowns[0])
-    total_students = len(breakdowns)
-    correct_counts = [0 for _ in range(num_items)]
-    item_matrix: List[List[bool]] = [[False] * num_items for _ in range(total_students)]
-
-    for student_idx, items in enumerate(breakdowns):
-        for item in items:
-            index = int(item['item']) - 1
-            is_correct = bool(item['correct'])
-            if is_correct:
-                correct_counts[index] += 1
-            item_matrix[student_idx][index] = is_correct
-
-    difficulty = _difficulty(correct_counts, total_students)
-    discrimination = _discrimination_index(item_matrix, totals)
-    point_biserial = _point_biserial(item_matrix, totals)
-
-    p_q_sum = sum(p * (1 - p) for p in difficulty)
-    variance_total = pstdev(totals) ** 2 or 1.0
-    kr20 = (num_items / (num_items - 1)) * (1 - (p_q_sum / variance_total)) if num_items > 1 else 0.0
+    order = np.argsort(totals, kind='stable')
+    bottom = matrix[order[:slice_size]].sum(axis=0)
+    top = matrix[order[-slice_size:]].sum(axis=0)
+    return (top - bottom) / slice_size
+
+
+def _point_biserial_from_sums(n: int, sum_totals: float, sd_total: float, correct: np.ndarray, correct_sums: np.ndarray) -> np.ndarray:
+    incorrect = n - correct
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_correct = correct_sums / correct
+        mean_incorrect = (sum_totals - correct_sums) / incorrect
+        p = correct / n
+        r_pb = ((mean_correct - mean_incorrect) / (sd_total or 1.0)) * np.sqrt(p * (1 - p))
+    return np.where((correct > 0) & (incorrect > 0), r_pb, 0.0)
+
+
+def _point_biserial(matrix: np.ndarray, totals: np.ndarray) -> np.ndarray:
+    n = matrix.shape[0]
+    if n == 0:
+        return np.zeros(matrix.shape[1])
+    correct = np.count_nonzero(matrix, axis=0).astype(np.float64)
+    return _point_biserial_from_sums(n, float(totals.sum()), float(totals.std()), correct, totals @ matrix)
+
+
+def _kr20(difficulty: np.ndarray, variance_total: float) -> float:
+    num_items = difficulty.shape[0]
+    if num_items <= 1:
+        return 0.0
+    p_q_sum = float((difficulty * (1 - difficulty)).sum())
+    return (num_items / (num_items - 1)) * (1 - (p_q_sum / (variance_total or 1.0)))
+
+
+def _analytics_from_sums(
+    exam_id: int,
+    n: int,
+    sum_totals: float,
+    sum_squares: float,
+    sum_percent: float,
+    correct: np.ndarray,
+    correct_sums: np.ndarray,
+    discrimination: np.ndarray,
+) -> ExamAnalytics:
+    if n == 0:
+        return ExamAnalytics(exam_id=exam_id, kr20=0.0, average_score=0.0, average_percent=0.0, item_stats=[])
+    mean_total = sum_totals / n
+    variance_total = max(sum_squares / n - mean_total ** 2, 0.0)
+    difficulty = correct / n
+    point_biserial = _point_biserial_from_sums(n, sum_totals, variance_total ** 0.5, correct, correct_sums)
+    kr20 = _kr20(difficulty, variance_total)
+    if discrimination.shape != difficulty.shape:
+        discrimination = np.zeros_like(difficulty)
 
     item_stats = [
-        ItemAnalytics(item=index + 1, difficulty=difficulty[index], discrimination_index=discrimination[index], point_biserial=point_biserial[index])
-        for index in range(num_items)
+        ItemAnalytics(item=index + 1, difficulty=float(p), discrimination_index=float(d), point_biserial=float(r))
+        for index, (p, d, r) in enumerate(zip(difficulty, discrimination, point_biserial))
     ]
-
     return ExamAnalytics(
-        exam_id=exam.id,
+        exam_id=exam_id,
         kr20=round(kr20, 4),
-        average_score=round(mean(totals), 2),
-        average_percent=round(mean(score.percent for score in scores), 2),
+        average_score=round(mean_total, 2),
+        average_percent=round(sum_percent / n, 2),
         item_stats=item_stats,
     )
+
+
+def _load_matrix(exam: Exam) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    rows = list(exam.scores.values_list('set_code', 'responses', 'raw_score', 'percent'))
+    keys = dict(exam.sets.values_list('set_code', 'answer_key'))
+    if not rows:
+        return np.zeros((0, key_length(keys)), dtype=bool), np.zeros(0), np.zeros(0)
+    set_codes, responses, raw_scores, percents = zip(*rows)
+    matrix = correctness_matrix(set_codes, responses, keys)
+    return matrix, np.asarray(raw_scores, dtype=np.float64), np.asarray(percents, dtype=np.float64)
+
+
+def compute_exam_analytics(exam: Exam) -> ExamAnalytics:
+    """Full item analysis straight from every stored score."""
+    matrix, totals, percents = _load_matrix(exam)
+    return _analytics_from_sums(
+        exam.id,
+        matrix.shape[0],
+        float(totals.sum()),
+        float(totals @ totals),
+        float(percents.sum()),
+        np.count_nonzero(matrix, axis=0).astype(np.float64),
+        totals @ matrix,
+        _discrimination_index(matrix, totals),
+    )
+
+
+def rebuild_snapshot(exam: Exam) -> ExamAnalyticsSnapshot:
+    """Recompute every running statistic (and the discrimination index) from scratch.
+
+    Scores are read while holding the snapshot row lock that
+    :func:`record_score_changes` takes, so a delta is either already in the
+    scores read here or applied on top of the rebuilt snapshot. A missing
+    snapshot is first created empty (and stale) so that concurrent writers
+    have a row to lock instead of skipping their delta.
+    """
+    num_items = key_length(dict(exam.sets.values_list('set_code', 'answer_key')))
+    ExamAnalyticsSnapshot.objects.get_or_create(
+        exam=exam,
+        defaults={
+            'num_items': num_items,
+            'item_correct': [0] * num_items,
+            'item_total_sums': [0.0] * num_items,
+            'discrimination': [0.0] * num_items,
+        },
+    )
+    with transaction.atomic():
+        snapshot = ExamAnalyticsSnapshot.objects.select_for_update().get(exam=exam)
+        matrix, totals, percents = _load_matrix(exam)
+        now = timezone.now()
+        snapshot.num_items = matrix.shape[1]
+        snapshot.students = matrix.shape[0]
+        snapshot.sum_totals = float(totals.sum())
+        snapshot.sum_squares = float(totals @ totals)
+        snapshot.sum_percent = float(percents.sum())
+        snapshot.item_correct = np.count_nonzero(matrix, axis=0).tolist()
+        snapshot.item_total_sums = (totals @ matrix).tolist()
+        snapshot.discrimination = _discrimination_index(matrix, totals).tolist()
+        snapshot.discrimination_refreshed_at = now
+        snapshot.changed_at = now
+        snapshot.save()
+    return snapshot
+
+
+def invalidate_snapshot(exam_id: int) -> None:
+    ExamAnalyticsSnapshot.objects.filter(exam_id=exam_id).delete()
+
+
+def record_score_changes(
+    exam: Exam,
+    removed: Sequence[ScoreRow],
+    added: Sequence[ScoreRow],
+    keys: Optional[Dict[str, Sequence[str]]] = None,
+) -> None:
+    """Fold replaced and new scores into the exam's running statistics.
+
+    Call inside the transaction that writes the scores. Without a snapshot
+    there is nothing to maintain; it is built on the next read.
+    """
+    rows = list(removed) + list(added)
+    if not rows:
+        return
+    with transaction.atomic():
+        snapshot = ExamAnalyticsSnapshot.objects.select_for_update().filter(exam=exam).first()
+        if snapshot is None:
+            return
+        if keys is None:
+            keys = dict(exam.sets.values_list('set_code', 'answer_key'))
+        if key_length(keys) != snapshot.num_items:
+            snapshot.delete()
+            return
+
+        set_codes, responses, totals, percents = zip(*rows)
+        matrix = correctness_matrix(set_codes, responses, keys)
+        sign = np.concatenate([-np.ones(len(removed)), np.ones(len(added))])
+        totals = np.asarray(totals, dtype=np.float64)
+        snapshot.students += int(sign.sum())
+        snapshot.sum_totals += float(sign @ totals)
+        snapshot.sum_squares += float(sign @ totals ** 2)
+        snapshot.sum_percent += float(sign @ np.asarray(percents, dtype=np.float64))
+        snapshot.item_correct = (np.asarray(snapshot.item_correct) + (sign @ matrix).astype(np.int64)).tolist()
+        snapshot.item_total_sums = (np.asarray(snapshot.item_total_sums) + (sign * totals) @ matrix).tolist()
+        snapshot.changed_at = timezone.now()
+        snapshot.save()
+
+
+def exam_analytics(exam: Exam) -> ExamAnalytics:
+    """Serve analytics from the exam's snapshot in O(items).
+
+    The snapshot is (re)built when missing, and rebuilt when its
+    discrimination index is stale and older than
+    ``settings.ANALYTICS_DISCRIMINATION_MAX_AGE`` seconds.
+    """
+    snapshot = ExamAnalyticsSnapshot.objects.filter(exam=exam).first()
+    max_age = timedelta(seconds=settings.ANALYTICS_DISCRIMINATION_MAX_AGE)
+    if snapshot is None or (
+        snapshot.discrimination_stale
+        and (snapshot.discrimination_refreshed_at is None or snapshot.discrimination_refreshed_at < timezone.now() - max_age)
+    ):
+        snapshot = rebuild_snapshot(exam)
+
+    analytics = _analytics_from_sums(
+        exam.id,
+        snapshot.students,
+        snapshot.sum_totals,
+        snapshot.sum_squares,
+        snapshot.sum_percent,
+        np.asarray(snapshot.item_correct, dtype=np.float64),
+        np.asarray(snapshot.item_total_sums, dtype=np.float64),
+        np.asarray(snapshot.discrimination, dtype=np.float64),
+    )
+    analytics.discrimination_refreshed_at = snapshot.discrimination_refreshed_at
+    analytics.discrimination_stale = snapshot.discrimination_stale
+    return analytics
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from exams.models import ExamSet, Score
+from .services import invalidate_snapshot
+
+
+@receiver([post_save, post_delete], sender=ExamSet)
+def answer_key_changed(sender, instance, **kwargs):
+    # Correctness of every stored response may have changed.
+    invalidate_snapshot(instance.exam_id)
+
+
+@receiver(post_delete, sender=Score)
+def score_deleted(sender, instance, **kwargs):
+    invalidate_snapshot(instance.exam_id)
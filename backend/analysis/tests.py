@@ -1,9 +1,14 @@
+from unittest import mock
+
+import numpy as np
 from django.test import TestCase
 
 from core.models import Batch, Student
-from exams.models import Exam, ExamSet
+from exams.models import Exam, ExamSet, Score
 from exams.services import upsert_score
-from .services import compute_exam_analytics
+from .models import ExamAnalyticsSnapshot
+from . import services
+from .services import _discrimination_index, _point_biserial, compute_exam_analytics, exam_analytics
 
 
 class AnalyticsTests(TestCase):
@@ -11,7 +16,7 @@ class AnalyticsTests(TestCase):
         batch = Batch.objects.create(name='Batch 1', code='B1')
         self.exam = Exam.objects.create(batch=batch, title='Quiz', num_items=4)
         ExamSet.objects.create(exam=self.exam, set_code='A', answer_key=['A', 'B', 'C', 'D'])
-        students = [
+        self.students = students = [
             Student.objects.create(batch=batch, student_number=f'{i:03d}', full_name=f'Student {i}')
             for i in range(1, 6)
         ]
@@ -32,3 +37,62 @@ class AnalyticsTests(TestCase):
         self.assertEqual(len(analytics.item_stats), 4)
         first_item = analytics.item_stats[0]
         self.assertAlmostEqual(first_item.difficulty, 0.8)
+
+    def test_snapshot_is_maintained_incrementally(self):
+        exam_analytics(self.exam)
+        snapshot = ExamAnalyticsSnapshot.objects.get(exam=self.exam)
+        self.assertFalse(snapshot.discrimination_stale)
+
+        upsert_score(exam=self.exam, student=self.students[1], set_code='A', answers=['B', 'B', 'C', 'D'])
+        extra = Student.objects.create(batch=self.exam.batch, student_number='006', full_name='Student 6')
+        upsert_score(exam=self.exam, student=extra, set_code='A', answers=['A', 'C', 'C', 'B'])
+
+        served = exam_analytics(self.exam)
+        full = compute_exam_analytics(self.exam)
+        self.assertTrue(served.discrimination_stale)
+        self.assertAlmostEqual(served.kr20, full.kr20)
+        self.assertAlmostEqual(served.average_percent, full.average_percent)
+        for cached, fresh in zip(served.item_stats, full.item_stats):
+            self.assertAlmostEqual(cached.difficulty, fresh.difficulty)
+            self.assertAlmostEqual(cached.point_biserial, fresh.point_biserial)
+
+    def test_rebuild_reads_scores_under_the_snapshot_lock(self):
+        # A delta written while the scores are read must find a snapshot row to
+        # lock (and so wait for the rebuild) instead of being skipped.
+        def load(exam):
+            self.assertTrue(ExamAnalyticsSnapshot.objects.filter(exam=exam).exists())
+            return load_matrix(exam)
+
+        load_matrix = services._load_matrix
+        with mock.patch.object(services, '_load_matrix', side_effect=load) as loaded:
+            snapshot = services.rebuild_snapshot(self.exam)
+        loaded.assert_called_once()
+        self.assertEqual(snapshot.students, 5)
+        self.assertFalse(snapshot.discrimination_stale)
+
+    def test_answer_key_change_invalidates_snapshot(self):
+        exam_analytics(self.exam)
+        ExamSet.objects.filter(exam=self.exam).first().save()
+        self.assertFalse(ExamAnalyticsSnapshot.objects.filter(exam=self.exam).exists())
+        Score.objects.filter(exam=self.exam).first().delete()
+        self.assertEqual(exam_analytics(self.exam).item_stats[0].difficulty, compute_exam_analytics(self.exam).item_stats[0].difficulty)
+
+
+class AnalyticsKernelTests(TestCase):
+    def test_kernels_match_per_item_definitions(self):
+        rng = np.random.default_rng(7)
+        matrix = rng.random((200, 12)) < rng.random(12)
+        matrix[:, 0] = True
+        totals = matrix.sum(axis=1).astype(float)
+
+        r_pb = _point_biserial(matrix, totals)
+        self.assertEqual(r_pb[0], 0.0)
+        item = matrix[:, 5]
+        p = item.mean()
+        expected = (totals[item].mean() - totals[~item].mean()) / totals.std() * np.sqrt(p * (1 - p))
+        self.assertAlmostEqual(r_pb[5], expected)
+
+        order = np.argsort(totals, kind='stable')
+        k = int(200 * 0.27)
+        expected = matrix[order[-k:], 5].mean() - matrix[order[:k], 5].mean()
+        self.assertAlmostEqual(_discrimination_index(matrix, totals)[5], expected)
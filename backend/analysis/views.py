@@ -4,7 +4,7 @@ from rest_framework.views import APIView
 
 from accounts.permissions import IsAdminOrChecker
 from exams.models import Exam
-from .services import compute_exam_analytics
+from .services import exam_analytics
 
 
 class ExamAnalyticsView(APIView):
@@ -12,12 +12,14 @@ class ExamAnalyticsView(APIView):
 
     def get(self, request, exam_id: int):
         exam = Exam.objects.get(pk=exam_id)
-        analytics = compute_exam_analytics(exam)
+        analytics = exam_analytics(exam)
         data = {
             'exam_id': analytics.exam_id,
             'kr20': analytics.kr20,
             'average_score': analytics.average_score,
             'average_percent': analytics.average_percent,
+            'discrimination_refreshed_at': analytics.discrimination_refreshed_at,
+            'discrimination_stale': analytics.discrimination_stale,
             'item_stats': [
                 {
                     'item': stat.item,
@@ -0,0 +1,119 @@
+"""Run the benchmark suite and emit JSON.
+
+    python -m benchmarks --scale small medium --output bench.json
+    python -m benchmarks --baseline bench.json --tolerance 0.25
+
+Database cases run against a freshly created test database that is
+destroyed afterwards, so the configured database is never touched.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+import django
+
+DB_CASES = {'exam_pipeline', 'student_import'}
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metadata(connection) -> Dict[str, object]:
+    import cv2
+    import numpy as np
+
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'django': django.get_version(),
+        'database': connection.vendor,
+    }
+
+
+def _key(row: Dict[str, object]) -> str:
+    return json.dumps([row['name'], row['scale'], row['params']], sort_keys=True)
+
+
+def _regressions(current: List[Dict[str, object]], baseline_path: Path, tolerance: float) -> List[str]:
+    baseline = {_key(row): row for row in json.loads(baseline_path.read_text())['results']}
+    messages = []
+    for row in current:
+        before = baseline.get(_key(row))
+        if before and row['median_ms'] > before['median_ms'] * (1 + tolerance):
+            messages.append(
+                f"{row['name']} [{row['scale']}] {row['params']}: {before['median_ms']} -> {row['median_ms']} ms"
+            )
+    return messages
+
+
+def main(argv: List[str] | None = None) -> int:
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'omr_backend.settings')
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    from .cases import CASES, SCALES
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', nargs='+', choices=list(SCALES), default=['small'])
+    parser.add_argument('--case', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', type=Path, help='Write JSON here instead of stdout.')
+    parser.add_argument('--baseline', type=Path, help='Earlier JSON output to compare medians against.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown vs the baseline (0.2 = 20%%).')
+    args = parser.parse_args(argv)
+
+    rows: List[Dict[str, object]] = []
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        with tempfile.TemporaryDirectory(prefix='omr-bench-') as tmp:
+            for scale in args.scale:
+                for case in args.case:
+                    workdir = Path(tmp, scale, case)
+                    workdir.mkdir(parents=True)
+                    print(f'{scale}: {case}', file=sys.stderr)
+                    for result in CASES[case](SCALES[scale], max(1, args.repeat), workdir):
+                        result.scale = scale
+                        rows.append(result.as_dict())
+        report = {'meta': _metadata(connection), 'results': rows}
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        regressions = _regressions(rows, args.baseline, args.tolerance)
+        for message in regressions:
+            print(f'REGRESSION {message}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
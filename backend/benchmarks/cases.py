@@ -0,0 +1,256 @@
+"""Benchmark cases for the reader, grading, analytics, exports and imports.
+
+Every case takes the scale parameters, a repeat count and a scratch
+directory and returns :class:`~benchmarks.harness.Result` rows. Cases
+that touch the database expect to run against a throwaway test database
+(see ``benchmarks.__main__``).
+"""
+from __future__ import annotations
+
+import io
+import statistics
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+from .harness import Result, measure
+
+SCALES: Dict[str, Dict[str, int]] = {
+    'small': {'sheets': 12, 'students': 1_000, 'items': 100, 'grade_calls': 5_000, 'roster': 2_000},
+    'medium': {'sheets': 60, 'students': 10_000, 'items': 100, 'grade_calls': 20_000, 'roster': 30_000},
+    'large': {'sheets': 240, 'students': 50_000, 'items': 200, 'grade_calls': 50_000, 'roster': 100_000},
+}
+SCAN_DPIS = (150, 200, 300)
+# A real 300 DPI scan of the PRTC sheet, kept at the repository root.
+SAMPLE_SCAN = Path(__file__).resolve().parents[2] / 'Test_1.jpg'
+OPTIONS = 'ABCDE'
+
+
+def _random_answers(rng: np.random.Generator, items: int, blank_rate: float = 0.03) -> List[str]:
+    answers = rng.choice(list(OPTIONS), size=items).tolist()
+    for index in np.flatnonzero(rng.random(items) < blank_rate):
+        answers[index] = ''
+    return answers
+
+
+def bench_process_scan(scale: Dict[str, int], repeat: int, workdir: Path) -> List[Result]:
+    from omr.layout import load_layout
+    from omr.reader import process_scan
+    from omr.synthetic import degrade_sheet, render_sheet
+
+    layout = load_layout()
+    rng = np.random.default_rng(19)
+    results: List[Result] = []
+    for dpi in SCAN_DPIS:
+        factor = dpi * layout.paper[0] / layout.width
+        sheets = []
+        for index in range(scale['sheets']):
+            answers = _random_answers(rng, len(layout.items.boxes))
+            number = ''.join(rng.choice(list('0123456789'), size=len(layout.student_id.boxes)))
+            set_code = str(rng.choice(list(layout.set_code.options)))
+            sheet = render_sheet(answers, student_number=number, set_code=set_code, scale=factor)
+            sheet = degrade_sheet(
+                sheet,
+                angle=float(rng.uniform(-2.0, 2.0)),
+                shift=(float(rng.uniform(-10, 10)) * factor, float(rng.uniform(-10, 10)) * factor),
+                noise=8.0,
+                blur=1,
+                margin=int(30 * factor),
+                seed=index,
+            )
+            # Scanners hand over JPEGs; a lossless file of a noisy page decodes several times slower.
+            path = workdir / f'sheet-{dpi}-{index:04d}.jpg'
+            cv2.imwrite(str(path), sheet, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            sheets.append((str(path), answers, number))
+
+        outcomes: List[bool] = []
+        ids: List[bool] = []
+        stages: Dict[str, List[float]] = defaultdict(list)
+
+        def read_all():
+            outcomes.clear()
+            ids.clear()
+            for path, answers, number in sheets:
+                result = process_scan(path)
+                outcomes.append(result.answers == answers)
+                ids.append(result.student_number == number)
+                for stage, ms in result.timings.items():
+                    stages[stage].append(ms)
+
+        runs = measure(read_all, repeat)
+        results.append(Result(
+            name='omr.process_scan',
+            scale='',
+            params={'dpi': dpi, 'sheets': len(sheets), 'height_px': int(sheet.shape[0])},
+            runs_ms=runs,
+            units=len(sheets),
+            extra={
+                'exact_answer_rate': round(sum(outcomes) / len(outcomes), 4) if outcomes else None,
+                'student_number_rate': round(sum(ids) / len(ids), 4) if ids else None,
+                'stage_median_ms': {stage: round(statistics.median(values), 3) for stage, values in stages.items()},
+            },
+        ))
+    return results
+
+
+def bench_sample_scan(scale: Dict[str, int], repeat: int, workdir: Path) -> List[Result]:
+    """Time ``process_scan`` end to end, decoding included, on the real sample scan.
+
+    Reads either search for the timing marks from scratch or start from the
+    previous read's transform, as consecutive sheets from one feeder do.
+    """
+    from omr import reader
+
+    if not SAMPLE_SCAN.exists():
+        return []
+    reads = scale['sheets']
+    expected = reader.process_scan(str(SAMPLE_SCAN))
+    results: List[Result] = []
+    for registration in ('search', 'seeded'):
+        stages: Dict[str, List[float]] = defaultdict(list)
+        matches: List[bool] = []
+
+        def read_all():
+            matches.clear()
+            for _ in range(reads):
+                if registration == 'search':
+                    reader._registration_seeds.clear()
+                result = reader.process_scan(str(SAMPLE_SCAN))
+                matches.append(result.answers == expected.answers and result.student_number == expected.student_number)
+                for stage, ms in result.timings.items():
+                    stages[stage].append(ms)
+
+        runs = measure(read_all, repeat)
+        results.append(Result(
+            name='omr.process_scan',
+            scale='',
+            params={'sheet': SAMPLE_SCAN.name, 'registration': registration, 'reads': reads},
+            runs_ms=runs,
+            units=reads,
+            extra={
+                'stage_median_ms': {stage: round(statistics.median(values), 3) for stage, values in stages.items()},
+                'stable_read_rate': round(sum(matches) / len(matches), 4) if matches else None,
+            },
+        ))
+    return results
+
+
+def bench_grade_answers(scale: Dict[str, int], repeat: int, workdir: Path) -> List[Result]:
+    from exams.answer_keys import AnswerKey
+    from exams.responses import key_codes
+    from exams.services import grade_answers
+
+    rng = np.random.default_rng(7)
+    items = scale['items']
+    key = _random_answers(rng, items, blank_rate=0)
+    compiled = AnswerKey(set_code='A', answers=tuple(key), codes=key_codes(key))
+    sheets = [_random_answers(rng, items) for _ in range(scale['grade_calls'])]
+    results = []
+    for label, answer_key in (('list', key), ('compiled', compiled)):
+        runs = measure(lambda: [grade_answers(answers, answer_key) for answers in sheets], repeat)
+        results.append(Result(
+            name='exams.grade_answers', scale='', params={'items': items, 'calls': len(sheets), 'key': label},
+            runs_ms=runs, units=len(sheets),
+        ))
+    return results
+
+
+def _seed_exam(students: int, items: int, label: str):
+    from core.models import Batch, Student
+    from exams.models import Exam, ExamSet
+    from exams.services import upsert_scores
+
+    rng = np.random.default_rng(students)
+    batch = Batch.objects.create(name=f'Benchmark {label}', code=f'bench-{label}')
+    roster = Student.objects.bulk_create(
+        [Student(batch=batch, student_number=f'{i:07d}', full_name=f'Student {i}') for i in range(students)],
+        batch_size=5000,
+    )
+    exam = Exam.objects.create(batch=batch, title=f'Benchmark {label}', num_items=items)
+    keys = {code: _random_answers(rng, items, blank_rate=0) for code in 'AB'}
+    for code, key in keys.items():
+        ExamSet.objects.create(exam=exam, set_code=code, answer_key=key)
+    entries = []
+    for student in roster:
+        set_code = 'A' if rng.random() < 0.5 else 'B'
+        # Mostly right answers so item statistics are not degenerate.
+        answers = [key if rng.random() < 0.7 else str(rng.choice(list(OPTIONS))) for key in keys[set_code]]
+        entries.append((student, set_code, answers))
+
+    def write():
+        for start in range(0, len(entries), 5000):
+            upsert_scores(exam=exam, entries=entries[start:start + 5000])
+
+    runs = measure(write, 1)
+    return exam, Result(
+        name='exams.upsert_scores', scale='', params={'students': students, 'items': items},
+        runs_ms=runs, units=students,
+    )
+
+
+def bench_exam_pipeline(scale: Dict[str, int], repeat: int, workdir: Path) -> List[Result]:
+    from analysis.services import compute_exam_analytics, exam_analytics
+    from exams.exports import ExportUnavailable, iter_scores_columnar, iter_scores_csv
+    from exams.services import recompute_exam_scores
+
+    students, items = scale['students'], scale['items']
+    exam, seeded = _seed_exam(students, items, f'{students}x{items}')
+    params = {'students': students, 'items': items}
+    results = [seeded]
+
+    def drain(chunks):
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+        return size
+
+    results.append(Result('analysis.compute_exam_analytics', '', params, measure(lambda: compute_exam_analytics(exam), repeat), students))
+    exam_analytics(exam)
+    results.append(Result('analysis.exam_analytics_snapshot', '', params, measure(lambda: exam_analytics(exam), repeat), 1))
+    results.append(Result('exams.recompute_exam_scores', '', params, measure(lambda: recompute_exam_scores(exam), repeat), students))
+    results.append(Result('exports.csv', '', params, measure(lambda: drain(iter_scores_csv(exam)), repeat), students))
+    results.append(Result(
+        'exports.csv_items', '', params, measure(lambda: drain(iter_scores_csv(exam, include_items=True)), repeat), students,
+    ))
+    for fmt in ('parquet', 'arrow'):
+        try:
+            iter_scores_columnar(exam, fmt)
+        except ExportUnavailable:
+            continue
+        runs = measure(lambda: drain(iter_scores_columnar(exam, fmt)), repeat)
+        results.append(Result(f'exports.{fmt}', '', params, runs, students))
+    return results
+
+
+def bench_student_import(scale: Dict[str, int], repeat: int, workdir: Path) -> List[Result]:
+    from core.models import Batch, Student
+    from core.services import import_students
+
+    rows = scale['roster']
+    batch = Batch.objects.create(name='Benchmark roster', code=f'bench-roster-{rows}')
+    lines = ['student_number,full_name,email'] + [f'{i:07d},Student {i},s{i}@example.com' for i in range(rows)]
+    payload = ('\n'.join(lines) + '\n').encode('utf-8')
+    changed = payload.replace(b',Student 1', b',Renamed 1')
+
+    def run(data):
+        return lambda: import_students(io.BytesIO(data), default_batch=batch.pk)
+
+    params = {'rows': rows}
+    results = [
+        Result('core.import_students.create', '', params, measure(run(payload), repeat, setup=lambda: Student.objects.filter(batch=batch).delete()), rows),
+        Result('core.import_students.unchanged', '', params, measure(run(payload), repeat), rows),
+        Result('core.import_students.update', '', params, measure(run(changed), repeat, setup=run(payload)), rows),
+    ]
+    return results
+
+
+CASES = {
+    'process_scan': bench_process_scan,
+    'sample_scan': bench_sample_scan,
+    'grade_answers': bench_grade_answers,
+    'exam_pipeline': bench_exam_pipeline,
+    'student_import': bench_student_import,
+}
@@ -0,0 +1,39 @@
+"""Timing primitives shared by the benchmark cases."""
+from __future__ import annotations
+
+import statistics
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List
+
+
+@dataclass
+class Result:
+    name: str
+    scale: str
+    params: Dict[str, object]
+    runs_ms: List[float]
+    # Units of work per run (sheets, rows, calls...) for throughput figures.
+    units: int = 1
+    extra: Dict[str, object] = field(default_factory=dict)
+
+    def as_dict(self) -> Dict[str, object]:
+        data = asdict(self)
+        data['min_ms'] = round(min(self.runs_ms), 3)
+        data['median_ms'] = round(statistics.median(self.runs_ms), 3)
+        data['mean_ms'] = round(statistics.fmean(self.runs_ms), 3)
+        data['per_unit_ms'] = round(data['median_ms'] / self.units, 4) if self.units else None
+        data['runs_ms'] = [round(value, 3) for value in self.runs_ms]
+        return data
+
+
+def measure(fn: Callable[[], object], repeat: int, setup: Callable[[], object] | None = None) -> List[float]:
+    """Run ``fn`` ``repeat`` times (after an optional ``setup`` each time) and return wall times in ms."""
+    runs: List[float] = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - started) * 1000)
+    return runs
@@ -0,0 +1,48 @@
+"""Shared list-endpoint helpers: cursor pagination and sparse fieldsets."""
+from __future__ import annotations
+
+from typing import Optional, Set
+
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """Newest first by primary key; stable under concurrent inserts."""
+
+    ordering = '-id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+def requested_fields(request) -> Optional[Set[str]]:
+    """Field names asked for with ``?fields=a,b``, or ``None`` if not given."""
+    if request is None:
+        return None
+    raw = request.query_params.get('fields')
+    if not raw:
+        return None
+    return {name.strip() for name in raw.split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """Serializer mixin honouring ``?fields=`` on GET requests.
+
+    Without ``fields``, list responses leave out ``Meta.list_exclude`` so
+    heavy columns and nested objects are only sent when asked for.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        keep = requested_fields(request)
+        if keep is None:
+            view = self.context.get('view')
+            if getattr(view, 'action', None) != 'list':
+                return
+            keep = set(self.fields) - set(getattr(self.Meta, 'list_exclude', ()))
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import csv
+import io
+from dataclasses import dataclass, field
+from typing import IO, Dict, List, Optional, Tuple
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from .models import Batch, Student
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+_NUMBER_LENGTH = Student._meta.get_field('student_number').max_length
+_NAME_LENGTH = Student._meta.get_field('full_name').max_length
+
+
+@dataclass
+class ImportReport:
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    rejected: int = 0
+    errors: List[Dict[str, object]] = field(default_factory=list)
+
+    def reject(self, line: int, reason: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'reason': reason})
+
+
+def _parse_row(row: Dict[str, str], default_batch) -> Tuple[Optional[Tuple[int, str, str, str]], str]:
+    try:
+        batch_id = int(str(row.get('batch') or default_batch).strip())
+    except (TypeError, ValueError):
+        return None, 'missing or invalid batch'
+    number = (row.get('student_number') or row.get('student_no') or '').strip()
+    if not number:
+        return None, 'missing student_number'
+    if len(number) > _NUMBER_LENGTH:
+        return None, 'student_number is too long'
+    name = (row.get('full_name') or row.get('name') or '').strip()
+    if len(name) > _NAME_LENGTH:
+        return None, 'full_name is too long'
+    email = (row.get('email') or '').strip()
+    if email:
+        try:
+            validate_email(email)
+        except ValidationError:
+            return None, 'invalid email'
+    return (batch_id, number, name, email), ''
+
+
+def import_students(upload: IO[bytes], default_batch=None) -> ImportReport:
+    """Create or update students from a CSV roster.
+
+    The upload is decoded incrementally, diffed against the existing
+    ``(batch, student_number)`` pairs with one query, and only new or
+    changed rows are written, with chunked upserts inside one transaction.
+    Rows without a usable batch or student number, duplicates within the
+    file and unknown batches are rejected with their line number.
+    """
+    report = ImportReport()
+    parsed: Dict[Tuple[int, str], Tuple[int, str, str]] = {}
+    text = io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.DictReader(text)
+        for row in reader:
+            values, reason = _parse_row(row, default_batch)
+            if values is None:
+                report.reject(reader.line_num, reason)
+                continue
+            batch_id, number, name, email = values
+            if (batch_id, number) in parsed:
+                report.reject(reader.line_num, 'duplicate student_number in file')
+                continue
+            parsed[batch_id, number] = (reader.line_num, name, email)
+    except (UnicodeDecodeError, csv.Error) as exc:
+        raise ValueError(f'Could not read CSV: {exc}') from exc
+    finally:
+        text.detach()
+
+    batch_ids = {batch_id for batch_id, _ in parsed}
+    known = set(Batch.objects.filter(pk__in=batch_ids).values_list('pk', flat=True))
+    existing = {
+        (batch_id, number): (name, email)
+        for batch_id, number, name, email in Student.objects.filter(batch_id__in=known).values_list(
+            'batch_id', 'student_number', 'full_name', 'email',
+        )
+    }
+
+    changes: List[Student] = []
+    for (batch_id, number), (line, name, email) in parsed.items():
+        if batch_id not in known:
+            report.reject(line, 'unknown batch')
+            continue
+        current = existing.get((batch_id, number))
+        if current is None:
+            report.created += 1
+        elif current == (name, email):
+            report.unchanged += 1
+            continue
+        else:
+            report.updated += 1
+        changes.append(Student(batch_id=batch_id, student_number=number, full_name=name, email=email))
+
+    with transaction.atomic():
+        Student.objects.bulk_create(
+            changes,
+            batch_size=IMPORT_CHUNK_SIZE,
+            update_conflicts=True,
+            unique_fields=['batch', 'student_number'],
+            update_fields=['full_name', 'email'],
+        )
+    return report
@@ -0,0 +1,45 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from .models import Batch, Student
+
+
+class StudentImportTests(TestCase):
+    def setUp(self):
+        self.batch = Batch.objects.create(name='Batch 1', code='B1')
+        Student.objects.create(batch=self.batch, student_number='001', full_name='Alice', email='alice@example.com')
+        Student.objects.create(batch=self.batch, student_number='002', full_name='Bob')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='admin', password='pass', role=User.ROLE_ADMIN))
+
+    def _post(self, content: str, **data):
+        upload = SimpleUploadedFile('roster.csv', content.encode('utf-8-sig'), content_type='text/csv')
+        return self.client.post('/api/students/import_csv/', {'file': upload, **data}, format='multipart')
+
+    def test_import_reports_created_updated_and_rejected(self):
+        response = self._post(
+            'student_number,full_name,email\n'
+            '001,Alice,alice@example.com\n'
+            '002,Robert,\n'
+            '003,Carol,carol@example.com\n'
+            '003,Carol Again,\n'
+            ',Nobody,\n'
+            '004,Dan,not-an-email\n',
+            batch=self.batch.id,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {key: response.data[key] for key in ('created', 'updated', 'unchanged', 'rejected')},
+            {'created': 1, 'updated': 1, 'unchanged': 1, 'rejected': 3},
+        )
+        self.assertEqual([error['line'] for error in response.data['errors']], [5, 6, 7])
+        self.assertEqual(Student.objects.get(student_number='002').full_name, 'Robert')
+        self.assertEqual(Student.objects.get(student_number='003').full_name, 'Carol')
+
+    def test_unknown_batch_is_rejected(self):
+        response = self._post('batch,student_number,full_name\n9999,010,Eve\n')
+        self.assertEqual(response.data['rejected'], 1)
+        self.assertEqual(response.data['errors'][0]['reason'], 'unknown batch')
+        self.assertFalse(Student.objects.filter(student_number='010').exists())
@@ -1,5 +1,4 @@
-import csv
-import io
+from dataclasses import asdict
 
 from rest_framework import mixins, viewsets
 from rest_framework.decorators import action
@@ -8,6 +7,7 @@ from rest_framework.response import Response
 from accounts.permissions import IsAdmin, IsAdminOrReadOnly
 from .models import Batch, Student
 from .serializers import BatchSerializer, StudentSerializer
+from .services import import_students
 
 
 class BatchViewSet(viewsets.ModelViewSet):
@@ -33,21 +33,8 @@ class StudentViewSet(viewsets.ModelViewSet):
         file = request.FILES.get('file')
         if not file:
             return Response({'detail': 'file is required'}, status=400)
-        decoded = file.read().decode('utf-8')
-        reader = csv.DictReader(io.StringIO(decoded))
-        created = 0
-        for row in reader:
-            batch_id = row.get('batch') or request.data.get('batch')
-            if not batch_id:
-                continue
-            student, is_created = Student.objects.update_or_create(
-                batch_id=batch_id,
-                student_number=row.get('student_number') or row.get('student_no'),
-                defaults={
-                    'full_name': row.get('full_name') or row.get('name', ''),
-                    'email': row.get('email', ''),
-                },
-            )
-            if is_created:
-                created += 1
-        return Response({'created': created})
+        try:
+            report = import_students(file.file, default_batch=request.data.get('batch'))
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=400)
+        return Response(asdict(report))
@@ -10,7 +10,7 @@ class ExamSetInline(admin.TabularInline):
 
 @admin.register(Exam)
 class ExamAdmin(admin.ModelAdmin):
-    list_display = ('title', 'batch', 'num_items', 'created_at')
+    list_display = ('title', 'batch', 'num_items', 'sheet_layout', 'created_at')
     list_filter = ('batch',)
     inlines = [ExamSetInline]
 
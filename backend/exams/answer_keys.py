@@ -0,0 +1,113 @@
+"""Answer keys cached per exam as precompiled response codes.
+
+Keys are read for every graded scan but change rarely, so each exam's
+sets are loaded once into a process-local LRU. Every entry is tagged with
+the exam's key version, a stamp kept in the Django cache named by
+``settings.ANSWER_KEY_CACHE_ALIAS``; ``ExamSet`` save/delete signals (see
+``exams/signals.py``) replace the stamp, so a key edited in any process
+that shares that cache is never graded against from a stale copy. A
+lookup is one cache read and no database query. Writes that bypass the
+signals (``QuerySet.update``) must call :func:`invalidate_answer_keys`.
+"""
+from __future__ import annotations
+
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import ExamSet
+from .responses import key_codes
+
+
+@dataclass(frozen=True)
+class AnswerKey:
+    set_code: str
+    answers: Tuple[str, ...]
+    # Read-only uint8 codes as produced by ``key_codes``.
+    codes: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.answers)
+
+
+Keys = Dict[str, AnswerKey]
+
+_lock = threading.Lock()
+_local: 'OrderedDict[int, Tuple[str, Keys]]' = OrderedDict()
+
+
+def _compile(raw: Dict[str, list]) -> Keys:
+    keys: Keys = {}
+    for set_code, answers in raw.items():
+        codes = key_codes(answers)
+        codes.setflags(write=False)
+        keys[set_code] = AnswerKey(set_code=set_code, answers=tuple(answers), codes=codes)
+    return keys
+
+
+def _shared_cache():
+    return caches[settings.ANSWER_KEY_CACHE_ALIAS]
+
+
+def _cache_key(exam_id: int) -> str:
+    return f'exams:answer-keys:{exam_id}'
+
+
+def _version_key(exam_id: int) -> str:
+    return f'exams:answer-keys-version:{exam_id}'
+
+
+def _version(exam_id: int) -> str:
+    """The exam's current key version, starting a fresh one if the cache lost it."""
+    shared = _shared_cache()
+    version = shared.get(_version_key(exam_id))
+    if version is None:
+        # A new random stamp can't match anything cached before the loss.
+        shared.add(_version_key(exam_id), uuid.uuid4().hex, None)
+        version = shared.get(_version_key(exam_id))
+    return version
+
+
+def exam_answer_keys(exam_id: int) -> Keys:
+    """Return ``{set_code: AnswerKey}`` for the exam, loading the keys only when their version changed."""
+    version = _version(exam_id)
+    with _lock:
+        entry = _local.get(exam_id)
+        if entry is not None and entry[0] == version:
+            _local.move_to_end(exam_id)
+            return entry[1]
+
+    shared = _shared_cache()
+    cached = shared.get(_cache_key(exam_id))
+    if cached is not None and cached[0] == version:
+        raw = cached[1]
+    else:
+        raw = dict(ExamSet.objects.filter(exam_id=exam_id).values_list('set_code', 'answer_key'))
+        shared.set(_cache_key(exam_id), (version, raw))
+    keys = _compile(raw)
+
+    with _lock:
+        _local[exam_id] = (version, keys)
+        _local.move_to_end(exam_id)
+        while len(_local) > settings.ANSWER_KEY_CACHE_SIZE:
+            _local.popitem(last=False)
+    return keys
+
+
+def answer_key(exam_id: int, set_code: str) -> Optional[AnswerKey]:
+    return exam_answer_keys(exam_id).get(set_code)
+
+
+def invalidate_answer_keys(exam_id: int) -> None:
+    """Drop this process's copy and start a new key version for every other process."""
+    with _lock:
+        _local.pop(exam_id, None)
+    shared = _shared_cache()
+    shared.set(_version_key(exam_id), uuid.uuid4().hex, None)
+    shared.delete(_cache_key(exam_id))
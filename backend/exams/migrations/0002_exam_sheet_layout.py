@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exam',
+            name='sheet_layout',
+            field=models.CharField(default='prtc-100', max_length=50),
+        ),
+    ]
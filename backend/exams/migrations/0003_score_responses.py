@@ -0,0 +1,70 @@
+from django.db import migrations, models
+
+
+def _code(answer):
+    answer = '' if answer is None else str(answer)
+    if not answer:
+        return 0
+    if len(answer) == 1 and answer.isascii():
+        return ord(answer)
+    return ord('*')
+
+
+def pack_breakdowns(apps, schema_editor):
+    Score = apps.get_model('exams', 'Score')
+    batch = []
+    for score in Score.objects.only('pk', 'breakdown').iterator(chunk_size=2000):
+        items = sorted(score.breakdown or [], key=lambda item: int(item['item']))
+        score.responses = bytes(_code(item.get('answer')) for item in items)
+        batch.append(score)
+        if len(batch) >= 2000:
+            Score.objects.bulk_update(batch, ['responses'])
+            batch = []
+    if batch:
+        Score.objects.bulk_update(batch, ['responses'])
+
+
+def unpack_breakdowns(apps, schema_editor):
+    # Rebuild the per-item rows the old code stored. Answers that were
+    # packed as '*' (not a single option) cannot be recovered and stay '*'.
+    Score = apps.get_model('exams', 'Score')
+    ExamSet = apps.get_model('exams', 'ExamSet')
+    keys = {
+        (exam_id, set_code): answer_key
+        for exam_id, set_code, answer_key in ExamSet.objects.values_list('exam_id', 'set_code', 'answer_key')
+    }
+    batch = []
+    for score in Score.objects.only('pk', 'exam_id', 'set_code', 'responses').iterator(chunk_size=2000):
+        answers = ['' if code == 0 else chr(code) for code in bytes(score.responses)]
+        key = keys.get((score.exam_id, score.set_code)) or [''] * len(answers)
+        answers = (answers + [''] * len(key))[:len(key)]
+        score.breakdown = [
+            {'item': idx + 1, 'answer': given, 'key': expected, 'correct': given == expected}
+            for idx, (given, expected) in enumerate(zip(answers, key))
+        ]
+        batch.append(score)
+        if len(batch) >= 2000:
+            Score.objects.bulk_update(batch, ['breakdown'])
+            batch = []
+    if batch:
+        Score.objects.bulk_update(batch, ['breakdown'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0002_exam_sheet_layout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='score',
+            name='responses',
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.RunPython(pack_breakdowns, unpack_breakdowns),
+        migrations.RemoveField(
+            model_name='score',
+            name='breakdown',
+        ),
+    ]
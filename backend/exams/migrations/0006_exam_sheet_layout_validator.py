@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:11
+
+import exams.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exams', '0005_examset_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exam',
+            name='sheet_layout',
+            field=models.CharField(default='prtc-100', max_length=50, validators=[exams.models.validate_sheet_layout]),
+        ),
+    ]
@@ -1,12 +1,24 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 
 from core.models import Batch, Student
+from omr.layout import DEFAULT_LAYOUT, LayoutError, available_layouts, load_layout
+
+
+def validate_sheet_layout(value: str) -> None:
+    if value not in available_layouts():
+        raise ValidationError('Unknown sheet layout.')
+    try:
+        load_layout(value)
+    except LayoutError as exc:
+        raise ValidationError(str(exc)) from exc
 
 
 class Exam(models.Model):
     batch = models.ForeignKey(Batch, on_delete=models.CASCADE, related_name='exams')
     title = models.CharField(max_length=255)
     num_items = models.PositiveIntegerField(default=100)
+    sheet_layout = models.CharField(max_length=50, default=DEFAULT_LAYOUT, validators=[validate_sheet_layout])
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -20,6 +32,7 @@ class ExamSet(models.Model):
     exam = models.ForeignKey(Exam, on_delete=models.CASCADE, related_name='sets')
     set_code = models.CharField(max_length=10)
     answer_key = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('exam', 'set_code')
@@ -35,7 +48,8 @@ class Score(models.Model):
     set_code = models.CharField(max_length=10)
     raw_score = models.PositiveIntegerField(default=0)
     percent = models.FloatField(default=0.0)
-    breakdown = models.JSONField(default=list)
+    # One byte per item, see exams.responses.
+    responses = models.BinaryField(default=bytes)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -44,6 +58,10 @@ class Score(models.Model):
             models.UniqueConstraint(fields=['exam', 'student'], name='unique_exam_student_score'),
         ]
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['exam', '-updated_at'], name='score_exam_updated_idx'),
+            models.Index(fields=['exam', '-id'], name='score_exam_id_idx'),
+        ]
 
     def __str__(self) -> str:  # pragma: no cover
         return f"{self.exam_id}:{self.student_id} = {self.raw_score}"
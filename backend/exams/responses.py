@@ -0,0 +1,96 @@
+"""Compact one-byte-per-item encoding of a student's responses.
+
+Each item is stored as the ASCII code of the chosen option, ``0`` for a
+blank and ``*`` for anything that is not a single option (e.g. a
+double mark entered during review). Answers are compared exactly, as
+given. ``*`` never matches: keys are encoded with :func:`key_codes`,
+which turns it into ``NO_MATCH``. Encoded responses live in
+``Score.responses`` and decode straight into NumPy arrays for grading and
+analytics; the per-item breakdown the API shows is derived on demand.
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Mapping, Sequence
+
+import numpy as np
+
+BLANK = 0
+INVALID = ord('*')
+# Key-side code for anything a response cannot equal (multi-option keys, unknown sets).
+NO_MATCH = 0xFF
+
+
+def _code(answer) -> int:
+    answer = '' if answer is None else str(answer)
+    if not answer:
+        return BLANK
+    if len(answer) == 1 and answer.isascii():
+        return ord(answer)
+    return INVALID
+
+
+def encode_responses(answers: Iterable[str]) -> bytes:
+    return bytes(_code(answer) for answer in answers)
+
+
+def response_codes(answers: Sequence[str] | bytes | memoryview, length: int | None = None) -> np.ndarray:
+    """Return responses as a uint8 array, truncated or blank-padded to ``length``."""
+    if isinstance(answers, (bytes, bytearray, memoryview)):
+        codes = np.frombuffer(answers, dtype=np.uint8)
+    else:
+        codes = np.frombuffer(encode_responses(answers), dtype=np.uint8)
+    if length is None:
+        return codes
+    if codes.shape[0] >= length:
+        return codes[:length]
+    return np.concatenate([codes, np.zeros(length - codes.shape[0], dtype=np.uint8)])
+
+
+def key_codes(answer_key: Sequence[str]) -> np.ndarray:
+    """Encode an answer key for comparison with response codes; invalid entries never match."""
+    codes = response_codes(answer_key).copy()
+    codes[codes == INVALID] = NO_MATCH
+    return codes
+
+
+def _matches(given: str, key: str) -> bool:
+    code = _code(key)
+    return code != INVALID and _code(given) == code
+
+
+def decode_responses(data: bytes | memoryview) -> List[str]:
+    return ['' if code == BLANK else chr(code) for code in bytes(data)]
+
+
+def build_breakdown(data: bytes | memoryview, answer_key: Sequence[str]) -> List[Dict[str, object]]:
+    """Expand stored responses into the per-item rows shown by the API."""
+    answers = decode_responses(bytes(data)[:len(answer_key)])
+    answers += [''] * (len(answer_key) - len(answers))
+    return [
+        {'item': idx + 1, 'answer': given, 'key': key, 'correct': _matches(given, key)}
+        for idx, (given, key) in enumerate(zip(answers, answer_key))
+    ]
+
+
+def key_length(keys: Mapping[str, Sequence[str]]) -> int:
+    return max((len(key) for key in keys.values()), default=0)
+
+
+def correctness_matrix(set_codes: Sequence[str], responses: Sequence[bytes], keys: Mapping[str, Sequence[str]]) -> np.ndarray:
+    """Grade packed responses into a students x items boolean matrix.
+
+    ``keys`` maps set codes to answer keys. Items beyond a set's key (or
+    every item of an unknown set) count as incorrect.
+    """
+    num_items = key_length(keys)
+    packed = b''.join(bytes(data)[:num_items].ljust(num_items, b'\0') for data in responses)
+    codes = np.frombuffer(packed, dtype=np.uint8).reshape(len(responses), num_items)
+
+    # Row 0 is a sentinel key for unknown sets.
+    key_table = np.full((len(keys) + 1, num_items), NO_MATCH, dtype=np.uint8)
+    key_index: Dict[str, int] = {}
+    for row, (code, answer_key) in enumerate(keys.items(), start=1):
+        key_table[row, :len(answer_key)] = key_codes(answer_key)
+        key_index[code] = row
+    rows = np.fromiter((key_index.get(code, 0) for code in set_codes), dtype=np.intp, count=len(set_codes))
+    return codes == key_table[rows]
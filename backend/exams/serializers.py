@@ -1,9 +1,12 @@
-from typing import List
+from typing import List, Sequence
 
 from rest_framework import serializers
 
+from core.api import SparseFieldsMixin
 from core.serializers import StudentSerializer
+from .answer_keys import answer_key
 from .models import Exam, ExamSet, Score
+from .responses import build_breakdown, decode_responses
 
 
 class ExamSetSerializer(serializers.ModelSerializer):
@@ -17,22 +20,35 @@ class ExamSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Exam
-        fields = ['id', 'batch', 'title', 'num_items', 'created_at', 'sets']
+        fields = ['id', 'batch', 'title', 'num_items', 'sheet_layout', 'created_at', 'sets']
         read_only_fields = ['id', 'created_at', 'sets']
 
 
-class ScoreSerializer(serializers.ModelSerializer):
+class ScoreSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     student = StudentSerializer(read_only=True)
     student_id = serializers.PrimaryKeyRelatedField(queryset=Score._meta.get_field('student').remote_field.model.objects.all(), source='student', write_only=True)
+    answers = serializers.SerializerMethodField()
+    breakdown = serializers.SerializerMethodField()
 
     class Meta:
         model = Score
-        fields = ['id', 'exam', 'student', 'student_id', 'set_code', 'raw_score', 'percent', 'breakdown', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'raw_score', 'percent', 'breakdown', 'created_at', 'updated_at']
+        fields = ['id', 'exam', 'student', 'student_id', 'set_code', 'raw_score', 'percent', 'answers', 'breakdown', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'raw_score', 'percent', 'answers', 'breakdown', 'created_at', 'updated_at']
+        list_exclude = ['answers', 'breakdown']
+
+    def _answer_key(self, score: Score) -> Sequence[str]:
+        key = answer_key(score.exam_id, score.set_code)
+        return key.answers if key else []
+
+    def get_answers(self, obj: Score) -> List[str]:
+        return decode_responses(obj.responses)
+
+    def get_breakdown(self, obj: Score):
+        return build_breakdown(obj.responses, self._answer_key(obj))
 
     def validate(self, attrs):
         exam = attrs.get('exam') or getattr(self.instance, 'exam', None)
         set_code = attrs.get('set_code') or getattr(self.instance, 'set_code', None)
-        if exam and set_code and not exam.sets.filter(set_code=set_code).exists():
+        if exam and set_code and answer_key(exam.pk, set_code) is None:
             raise serializers.ValidationError({'set_code': 'Invalid set code for this exam.'})
         return attrs
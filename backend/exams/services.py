@@ -1,39 +1,52 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Dict, Iterable, List, Sequence
+from typing import Dict, Iterable, List, Sequence, Tuple
 
+import numpy as np
 from django.db import transaction
+from django.utils import timezone
 
+from analysis.services import ScoreRow, rebuild_snapshot, record_score_changes
 from core.models import Student
+from .answer_keys import AnswerKey, answer_key as cached_answer_key, exam_answer_keys, invalidate_answer_keys
 from .models import Exam, ExamSet, Score
+from .responses import build_breakdown, correctness_matrix, encode_responses, key_codes, response_codes
+
+RESCORE_CHUNK_SIZE = 2000
 
 
 @dataclass
 class ScoringResult:
     raw_score: int
     percent: float
-    breakdown: List[Dict[str, str]]
+    responses: bytes
+    answer_key: Sequence[str]
+
+    @property
+    def breakdown(self) -> List[Dict[str, object]]:
+        return build_breakdown(self.responses, self.answer_key)
 
 
-def grade_answers(answers: Sequence[str], answer_key: Sequence[str]) -> ScoringResult:
+def grade_answers(answers: Sequence[str] | bytes, answer_key: Sequence[str] | AnswerKey) -> ScoringResult:
+    responses = answers if isinstance(answers, bytes) else encode_responses(answers)
+    if isinstance(answer_key, AnswerKey):
+        key, answer_key = answer_key.codes, answer_key.answers
+    else:
+        key = key_codes(answer_key)
     total = len(answer_key)
-    correct = 0
-    breakdown: List[Dict[str, str]] = []
-    for idx, key in enumerate(answer_key):
-        given = answers[idx] if idx < len(answers) else ''
-        is_correct = given == key
-        if is_correct:
-            correct += 1
-        breakdown.append({'item': idx + 1, 'answer': given, 'key': key, 'correct': is_correct})
+    correct = int(np.count_nonzero(response_codes(responses, total) == key))
     percent = (correct / total) * 100 if total else 0
-    return ScoringResult(raw_score=correct, percent=percent, breakdown=breakdown)
+    return ScoringResult(raw_score=correct, percent=percent, responses=responses, answer_key=answer_key)
 
 
 @transaction.atomic
 def upsert_score(*, exam: Exam, student: Student, set_code: str, answers: Sequence[str]) -> Score:
-    exam_set = ExamSet.objects.get(exam=exam, set_code=set_code)
-    result = grade_answers(answers, exam_set.answer_key)
+    key = cached_answer_key(exam.pk, set_code)
+    if key is None:
+        raise ExamSet.DoesNotExist(f'Exam {exam.pk} has no set {set_code!r}')
+    result = grade_answers(answers, key)
+    previous = list(_score_rows(Score.objects.select_for_update().filter(exam=exam, student=student)))
     score, _ = Score.objects.update_or_create(
         exam=exam,
         student=student,
@@ -41,21 +54,114 @@ def upsert_score(*, exam: Exam, student: Student, set_code: str, answers: Sequen
             'set_code': set_code,
             'raw_score': result.raw_score,
             'percent': result.percent,
-            'breakdown': result.breakdown,
+            'responses': result.responses,
         },
     )
+    record_score_changes(exam, previous, [(set_code, result.responses, result.raw_score, result.percent)])
     return score
 
 
-def recompute_exam_scores(exam: Exam) -> int:
-    updated = 0
-    for score in exam.scores.select_related('student').all():
-        exam_set = exam.sets.get(set_code=score.set_code)
-        result = grade_answers([b['answer'] for b in score.breakdown], exam_set.answer_key)
-        Score.objects.filter(pk=score.pk).update(
+@transaction.atomic
+def save_score(score: Score) -> Score:
+    """Regrade and save a score edited outside ``upsert_score`` (the score API).
+
+    The change is folded into the exam's running statistics like any other
+    score write, including moving the row out of its old exam.
+    """
+    key = cached_answer_key(score.exam_id, score.set_code)
+    if key is None:
+        raise ExamSet.DoesNotExist(f'Exam {score.exam_id} has no set {score.set_code!r}')
+    result = grade_answers(bytes(score.responses), key)
+    previous_exam_id, previous = None, []
+    if score.pk:
+        rows = Score.objects.select_for_update().filter(pk=score.pk)
+        previous_exam_id = rows.values_list('exam_id', flat=True).first()
+        previous = list(_score_rows(rows))
+    score.raw_score, score.percent, score.responses = result.raw_score, result.percent, result.responses
+    score.save()
+    if previous_exam_id not in (None, score.exam_id):
+        record_score_changes(Exam.objects.get(pk=previous_exam_id), previous, [])
+        previous = []
+    record_score_changes(score.exam, previous, [(score.set_code, result.responses, result.raw_score, result.percent)])
+    return score
+
+
+def _score_rows(queryset) -> Iterable[ScoreRow]:
+    for set_code, responses, raw_score, percent in queryset.values_list('set_code', 'responses', 'raw_score', 'percent'):
+        yield set_code, bytes(responses), raw_score, percent
+
+
+@transaction.atomic
+def upsert_scores(*, exam: Exam, entries: Iterable[Tuple[Student, str, Sequence[str]]]) -> Dict[int, str]:
+    """Grade and write many scores for ``exam`` with one upsert statement.
+
+    Returns a mapping of student id to error message for entries that could
+    not be graded; later entries for the same student win.
+    """
+    compiled = exam_answer_keys(exam.pk)
+    keys = {set_code: key.answers for set_code, key in compiled.items()}
+    errors: Dict[int, str] = {}
+    scores: Dict[int, Score] = {}
+    for student, set_code, answers in entries:
+        if set_code not in keys:
+            errors[student.pk] = f'Unknown set code {set_code!r}'
+            scores.pop(student.pk, None)
+            continue
+        errors.pop(student.pk, None)
+        result = grade_answers(answers, compiled[set_code])
+        scores[student.pk] = Score(
+            exam=exam,
+            student=student,
+            set_code=set_code,
             raw_score=result.raw_score,
             percent=result.percent,
-            breakdown=result.breakdown,
+            responses=result.responses,
+        )
+    previous = list(_score_rows(Score.objects.select_for_update().filter(exam=exam, student_id__in=list(scores))))
+    Score.objects.bulk_create(
+        scores.values(),
+        update_conflicts=True,
+        unique_fields=['exam', 'student'],
+        update_fields=['set_code', 'raw_score', 'percent', 'responses', 'updated_at'],
+    )
+    added = [(score.set_code, score.responses, score.raw_score, score.percent) for score in scores.values()]
+    record_score_changes(exam, previous, added, keys=keys)
+    return errors
+
+
+@transaction.atomic
+def recompute_exam_scores(exam: Exam) -> int:
+    """Re-grade every score of ``exam`` against the current answer keys.
+
+    All keys are loaded once and every score is graded in one pass over the
+    students x items response matrix; only scores whose result changed are
+    written back, in chunks. Scores whose set no longer exists are left
+    untouched. Returns the number of scores re-graded.
+    """
+    # Keys may have been edited without signals (queryset.update); start fresh.
+    invalidate_answer_keys(exam.pk)
+    keys = dict(exam.sets.values_list('set_code', 'answer_key'))
+    rows = [
+        (pk, set_code, bytes(responses), raw_score, percent)
+        for pk, set_code, responses, raw_score, percent in exam.scores.filter(set_code__in=list(keys)).values_list(
+            'pk', 'set_code', 'responses', 'raw_score', 'percent'
+        )
+    ]
+    if rows:
+        pks, set_codes, responses, old_raw, old_percent = zip(*rows)
+        raw_scores = correctness_matrix(set_codes, responses, keys).sum(axis=1)
+        lengths = np.fromiter((len(keys[code]) for code in set_codes), dtype=np.float64, count=len(set_codes))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percents = np.where(lengths > 0, raw_scores / lengths * 100, 0.0)
+        changed = np.flatnonzero((raw_scores != np.asarray(old_raw)) | ~np.isclose(percents, np.asarray(old_percent)))
+        now = timezone.now()
+        Score.objects.bulk_update(
+            [
+                Score(pk=pks[i], raw_score=int(raw_scores[i]), percent=float(percents[i]), updated_at=now)
+                for i in changed
+            ],
+            ['raw_score', 'percent', 'updated_at'],
+            batch_size=RESCORE_CHUNK_SIZE,
         )
-        updated += 1
-    return updated
+    rebuild_snapshot(exam)
+    return len(rows)
@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .answer_keys import invalidate_answer_keys
+from .models import Exam, ExamSet
+
+
+@receiver([post_save, post_delete], sender=ExamSet)
+def answer_key_changed(sender, instance, **kwargs):
+    invalidate_answer_keys(instance.exam_id)
+    # A concurrent reader may cache the old key before this commits.
+    transaction.on_commit(lambda: invalidate_answer_keys(instance.exam_id))
+
+
+@receiver([post_save, post_delete], sender=Exam)
+def exam_changed(sender, instance, **kwargs):
+    invalidate_answer_keys(instance.pk)
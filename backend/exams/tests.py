@@ -1,8 +1,16 @@
+from unittest import mock
+
 from django.test import TestCase
+from rest_framework.test import APIClient
 
+from accounts.models import User
+from analysis.models import ExamAnalyticsSnapshot
+from analysis.services import compute_exam_analytics, exam_analytics
 from core.models import Batch, Student
+from . import answer_keys
+from .answer_keys import answer_key
 from .models import Exam, ExamSet, Score
-from .services import grade_answers, recompute_exam_scores, upsert_score
+from .services import grade_answers, recompute_exam_scores, upsert_score, upsert_scores
 
 
 class ScoringTests(TestCase):
@@ -17,6 +25,14 @@ class ScoringTests(TestCase):
         self.assertEqual(result.raw_score, 2)
         self.assertAlmostEqual(result.percent, (2 / 3) * 100)
         self.assertEqual(result.breakdown[1]['correct'], False)
+        self.assertEqual(result.responses, b'ACC')
+
+    def test_grading_is_exact_and_invalid_answers_never_match(self):
+        self.assertEqual(grade_answers(['AC'], ['AB']).raw_score, 0)
+        self.assertEqual(grade_answers(['AB'], ['AB']).raw_score, 0)
+        self.assertEqual(grade_answers(['a', ' B', 'C'], ['A', 'B', 'C']).raw_score, 1)
+        result = grade_answers(['AC', 'B'], ['AB', 'B'])
+        self.assertEqual([row['correct'] for row in result.breakdown], [False, True])
 
     def test_upsert_score(self):
         score = upsert_score(exam=self.exam, student=self.student, set_code='A', answers=['A', 'B', 'C'])
@@ -27,11 +43,158 @@ class ScoringTests(TestCase):
 
     def test_recompute(self):
         upsert_score(exam=self.exam, student=self.student, set_code='A', answers=['A', 'B', 'D'])
-        Score.objects.filter(student=self.student).update(breakdown=[
-            {'item': 1, 'answer': 'A', 'key': 'A', 'correct': True},
-            {'item': 2, 'answer': 'B', 'key': 'B', 'correct': True},
-            {'item': 3, 'answer': 'D', 'key': 'C', 'correct': False},
-        ])
+        Score.objects.filter(student=self.student).update(raw_score=0)
         updated = recompute_exam_scores(self.exam)
         self.assertEqual(updated, 1)
         self.assertEqual(Score.objects.get().raw_score, 2)
+
+    def test_upsert_scores_in_bulk(self):
+        other = Student.objects.create(batch=self.batch, student_number='002', full_name='Bob')
+        upsert_score(exam=self.exam, student=self.student, set_code='A', answers=['A', 'A', 'A'])
+        errors = upsert_scores(exam=self.exam, entries=[
+            (self.student, 'A', ['A', 'B', 'C']),
+            (other, 'Z', ['A', 'B', 'C']),
+        ])
+        self.assertEqual(list(errors), [other.pk])
+        self.assertEqual(Score.objects.count(), 1)
+        self.assertEqual(Score.objects.get(student=self.student).raw_score, 3)
+
+    def test_answer_keys_are_cached_until_the_set_changes(self):
+        upsert_score(exam=self.exam, student=self.student, set_code='A', answers=['A', 'B', 'C'])
+        # Served from memory: no key reload and no version query.
+        with self.assertNumQueries(0):
+            self.assertEqual(answer_key(self.exam.id, 'A').answers, ('A', 'B', 'C'))
+            self.assertIsNone(answer_key(self.exam.id, 'Z'))
+        self.exam_set.answer_key = ['A', 'B', 'D']
+        self.exam_set.save()
+        score = upsert_score(exam=self.exam, student=self.student, set_code='A', answers=['A', 'B', 'C'])
+        self.assertEqual(score.raw_score, 2)
+        self.exam_set.delete()
+        with self.assertRaises(ExamSet.DoesNotExist):
+            upsert_score(exam=self.exam, student=self.student, set_code='A', answers=['A', 'B', 'C'])
+
+    def test_key_edited_by_another_process_is_not_served_stale(self):
+        self.assertEqual(answer_key(self.exam.id, 'A').answers, ('A', 'B', 'C'))
+        # Another process saves the set: its signal bumps the shared version
+        # while this process still holds its own copy.
+        held = dict(answer_keys._local)
+        self.exam_set.answer_key = ['A', 'B', 'D']
+        self.exam_set.save()
+        answer_keys._local.update(held)
+        self.assertEqual(answer_key(self.exam.id, 'A').answers, ('A', 'B', 'D'))
+        score = upsert_score(exam=self.exam, student=self.student, set_code='A', answers=['A', 'B', 'C'])
+        self.assertEqual(score.raw_score, 2)
+
+    def test_recompute_after_key_change_across_sets(self):
+        other = Student.objects.create(batch=self.batch, student_number='002', full_name='Bob')
+        ExamSet.objects.create(exam=self.exam, set_code='B', answer_key=['C', 'B', 'A', 'D'])
+        upsert_score(exam=self.exam, student=self.student, set_code='A', answers=['A', 'B', 'D'])
+        upsert_score(exam=self.exam, student=other, set_code='B', answers=['C', 'B', 'A', 'A'])
+        self.exam_set.answer_key = ['A', 'B', 'D']
+        self.exam_set.save()
+        ExamSet.objects.filter(exam=self.exam, set_code='B').update(answer_key=['C', 'B', 'A', 'A'])
+
+        self.assertEqual(recompute_exam_scores(self.exam), 2)
+        self.assertEqual(Score.objects.get(student=self.student).raw_score, 3)
+        rescored = Score.objects.get(student=other)
+        self.assertEqual(rescored.raw_score, 4)
+        self.assertAlmostEqual(rescored.percent, 100.0)
+
+
+class ScoreBulkUpsertTests(TestCase):
+    def setUp(self):
+        self.batch = Batch.objects.create(name='Batch 1', code='B1')
+        self.exam = Exam.objects.create(batch=self.batch, title='Midterm', num_items=3)
+        ExamSet.objects.create(exam=self.exam, set_code='A', answer_key=['A', 'B', 'C'])
+        self.students = [
+            Student.objects.create(batch=self.batch, student_number=f'00{i}', full_name=f'Student {i}')
+            for i in range(1, 3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='admin', password='pass', role=User.ROLE_ADMIN))
+
+    def test_bulk_upsert_reports_per_student_errors(self):
+        payload = {
+            'exam': self.exam.id,
+            'set_code': 'A',
+            'answers': {
+                str(self.students[0].pk): ['A', 'B', 'C'],
+                str(self.students[1].pk): ['A', 'A', 'A'],
+                '999999': ['A', 'B', 'C'],
+                'abc': ['A'],
+            },
+        }
+        response = self.client.post('/api/scores/bulk_upsert/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['processed'], 2)
+        self.assertEqual(set(response.data['errors']), {'999999', 'abc'})
+        self.assertEqual(Score.objects.get(student=self.students[0]).raw_score, 3)
+
+        payload['set_code'] = 'Z'
+        response = self.client.post('/api/scores/bulk_upsert/', payload, format='json')
+        self.assertEqual(response.data['processed'], 0)
+        self.assertIn(str(self.students[0].pk), response.data['errors'])
+
+        for exam in ('abc', None, 999999):
+            payload['exam'] = exam
+            response = self.client.post('/api/scores/bulk_upsert/', payload, format='json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_score_list_omits_answers_unless_requested(self):
+        upsert_scores(exam=self.exam, entries=[(student, 'A', ['A', 'B', 'C']) for student in self.students])
+        response = self.client.get('/api/scores/', {'exam': self.exam.id})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertNotIn('breakdown', response.data['results'][0])
+        response = self.client.get('/api/scores/', {'exam': self.exam.id, 'fields': 'id,answers,breakdown'})
+        self.assertEqual(response.data['results'][0]['answers'], ['A', 'B', 'C'])
+        self.assertTrue(response.data['results'][0]['breakdown'][2]['correct'])
+
+    def test_score_api_writes_keep_analytics_snapshot_current(self):
+        ExamSet.objects.create(exam=self.exam, set_code='B', answer_key=['C', 'B', 'A'])
+        upsert_score(exam=self.exam, student=self.students[0], set_code='A', answers=['A', 'B', 'C'])
+        exam_analytics(self.exam)
+
+        response = self.client.post('/api/scores/', {'exam': self.exam.id, 'student_id': self.students[1].pk, 'set_code': 'A'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.patch(f"/api/scores/{Score.objects.get(student=self.students[0]).pk}/", {'set_code': 'B'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['raw_score'], 1)
+
+        served = exam_analytics(self.exam)
+        full = compute_exam_analytics(self.exam)
+        self.assertEqual(ExamAnalyticsSnapshot.objects.get(exam=self.exam).students, 2)
+        for cached, fresh in zip(served.item_stats, full.item_stats):
+            self.assertAlmostEqual(cached.difficulty, fresh.difficulty)
+
+    def test_export_streams_csv_with_item_columns(self):
+        upsert_scores(exam=self.exam, entries=[(self.students[0], 'A', ['A', 'B', 'D'])])
+        response = self.client.get(f'/api/exams/{self.exam.id}/export/', {'items': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'student_number,full_name,set_code,raw_score,percent,item_1,item_2,item_3')
+        self.assertEqual(lines[1].split(',')[-3:], ['A', 'B', 'D'])
+        self.assertEqual(len(lines), 2)
+
+    def test_export_matrix_as_parquet_and_arrow(self):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+        upsert_scores(exam=self.exam, entries=[(self.students[0], 'A', ['A', '', 'D']), (self.students[1], 'A', ['C', 'B', 'A'])])
+
+        with mock.patch('exams.exports.EXPORT_CHUNK_SIZE', 1):
+            response = self.client.get(f'/api/exams/{self.exam.id}/export-matrix/', {'type': 'parquet'})
+            self.assertEqual(response.status_code, 200)
+            table = pq.read_table(pa.BufferReader(b''.join(response.streaming_content)))
+        self.assertEqual(table.column_names[-3:], ['item_1', 'item_2', 'item_3'])
+        rows = {row['student_number']: row for row in table.to_pylist()}
+        self.assertEqual([rows[self.students[0].student_number][f'item_{i}'] for i in (1, 2, 3)], ['A', None, 'D'])
+
+        response = self.client.get(f'/api/exams/{self.exam.id}/export-matrix/', {'type': 'arrow'})
+        table = pa.ipc.open_stream(b''.join(response.streaming_content)).read_all()
+        self.assertEqual(table.num_rows, 2)
+
+        response = self.client.get(f'/api/exams/{self.exam.id}/export-matrix/', {'type': 'xlsx'})
+        self.assertEqual(response.status_code, 400)
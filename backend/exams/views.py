@@ -1,16 +1,17 @@
-import csv
-import io
+import time
 
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from accounts.permissions import IsAdmin, IsAdminOrChecker, IsAdminOrReadOnly
+from core.api import IdCursorPagination, requested_fields
 from core.models import Student
+from .exports import COLUMNAR_FORMATS, ExportUnavailable, iter_scores_columnar, iter_scores_csv
 from .models import Exam, ExamSet, Score
 from .serializers import ExamSerializer, ExamSetSerializer, ScoreSerializer
-from .services import recompute_exam_scores, upsert_score
+from .services import recompute_exam_scores, save_score, upsert_scores
 
 
 class ExamViewSet(viewsets.ModelViewSet):
@@ -28,24 +29,29 @@ class ExamViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'], permission_classes=[IsAdmin])
     def recompute(self, request, pk=None):
         exam = self.get_object()
+        started = time.perf_counter()
         updated = recompute_exam_scores(exam)
-        return Response({'updated': updated})
+        return Response({'updated': updated, 'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)})
 
     @action(detail=True, methods=['get'], permission_classes=[IsAdminOrChecker])
     def export(self, request, pk=None):
         exam = self.get_object()
-        response = HttpResponse(content_type='text/csv')
+        include_items = request.query_params.get('items') in {'1', 'true'}
+        response = StreamingHttpResponse(iter_scores_csv(exam, include_items=include_items), content_type='text/csv')
         response['Content-Disposition'] = f'attachment; filename=exam-{exam.pk}-scores.csv'
-        writer = csv.writer(response)
-        writer.writerow(['student_number', 'full_name', 'set_code', 'raw_score', 'percent'])
-        for score in exam.scores.select_related('student'):
-            writer.writerow([
-                score.student.student_number,
-                score.student.full_name,
-                score.set_code,
-                score.raw_score,
-                score.percent,
-            ])
+        return response
+
+    @action(detail=True, methods=['get'], permission_classes=[IsAdminOrChecker], url_path='export-matrix')
+    def export_matrix(self, request, pk=None):
+        exam = self.get_object()
+        fmt = request.query_params.get('type', 'parquet')
+        try:
+            content = iter_scores_columnar(exam, fmt)
+        except ExportUnavailable as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        content_type, suffix = COLUMNAR_FORMATS[fmt]
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename=exam-{exam.pk}-responses.{suffix}'
         return response
 
 
@@ -63,8 +69,9 @@ class ExamSetViewSet(viewsets.ModelViewSet):
 
 
 class ScoreViewSet(viewsets.ModelViewSet):
-    queryset = Score.objects.select_related('exam', 'student').all()
+    queryset = Score.objects.select_related('exam', 'student__batch').all()
     serializer_class = ScoreSerializer
+    pagination_class = IdCursorPagination
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
@@ -78,17 +85,51 @@ class ScoreViewSet(viewsets.ModelViewSet):
         exam_id = self.request.query_params.get('exam')
         if exam_id:
             queryset = queryset.filter(exam_id=exam_id)
+        if self.action == 'list' and not (requested_fields(self.request) or set()) & {'answers', 'breakdown'}:
+            queryset = queryset.defer('responses')
         return queryset
 
+    def perform_create(self, serializer):
+        serializer.instance = save_score(Score(**serializer.validated_data))
+
+    def perform_update(self, serializer):
+        score = serializer.instance
+        for field, value in serializer.validated_data.items():
+            setattr(score, field, value)
+        save_score(score)
+
     @action(detail=False, methods=['post'], permission_classes=[IsAdmin])
     def bulk_upsert(self, request, *args, **kwargs):
         exam_id = request.data.get('exam')
+        if not str(exam_id).isdigit():
+            return Response({'detail': 'Invalid exam id'}, status=status.HTTP_400_BAD_REQUEST)
+        exam = Exam.objects.filter(pk=int(exam_id)).first()
         set_code = request.data.get('set_code')
         answers_map = request.data.get('answers', {})
-        exam = Exam.objects.get(pk=exam_id)
-        updated = 0
+        if exam is None:
+            return Response({'detail': 'Exam not found'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(answers_map, dict):
+            return Response({'detail': 'answers must map student ids to answer lists'}, status=status.HTTP_400_BAD_REQUEST)
+
+        errors = {}
+        ids = {}
         for student_id, answers in answers_map.items():
-            student = Student.objects.get(pk=student_id)
-            upsert_score(exam=exam, student=student, set_code=set_code, answers=answers)
-            updated += 1
-        return Response({'processed': updated}, status=status.HTTP_200_OK)
+            if not str(student_id).isdigit():
+                errors[student_id] = 'Invalid student id'
+            elif not isinstance(answers, list):
+                errors[student_id] = 'Answers must be a list'
+            else:
+                ids[int(student_id)] = student_id
+        students = Student.objects.in_bulk(list(ids))
+        entries = []
+        for pk, student_id in ids.items():
+            if pk in students:
+                entries.append((students[pk], set_code, answers_map[student_id]))
+            else:
+                errors[student_id] = 'Student not found'
+
+        grading_errors = upsert_scores(exam=exam, entries=entries)
+        for pk, message in grading_errors.items():
+            errors[ids[pk]] = message
+        processed = len(entries) - len(grading_errors)
+        return Response({'processed': processed, 'errors': errors}, status=status.HTTP_200_OK)
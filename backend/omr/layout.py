@@ -0,0 +1,185 @@
+"""Declarative sheet layouts compiled into NumPy ROI tables.
+
+Each sheet design lives in a YAML file under ``omr/layouts`` (or any
+directory listed in ``settings.OMR_LAYOUT_DIRS``). A layout is compiled
+once per process into flat integral-image index arrays covering every
+bubble of the answer, student-number and set-code grids, so reading a
+registered sheet is a single gather-and-sum.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import yaml
+
+LAYOUTS_DIR = Path(__file__).with_name('layouts')
+DEFAULT_LAYOUT = 'prtc-100'
+
+
+class LayoutError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Grid:
+    options: str
+    # (groups, options, 4) int32 of x0, y0, x1, y1 for the printed bubbles.
+    boxes: np.ndarray
+    # Rows of the layout ROI table belonging to this grid.
+    window: slice
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.boxes.shape[0], self.boxes.shape[1]
+
+
+@dataclass(frozen=True)
+class SheetLayout:
+    key: str
+    name: str
+    version: int
+    width: int
+    height: int
+    # Printed timing mark width and height on the canvas.
+    timing_mark: Tuple[float, float]
+    # (marks, 2) float32 centres of each row of timing marks, left to right.
+    timing_rows: Tuple[np.ndarray, ...]
+    # Printed bubble width and height on the canvas.
+    bubble: Tuple[int, int]
+    # Physical sheet width and height in inches, when the layout declares them.
+    paper: Optional[Tuple[float, float]]
+    threshold: float
+    items: Grid
+    student_id: Grid
+    set_code: Grid
+    # (grids, 4) int32 x0, y0, x1, y1 bounding each bubble grid; registration
+    # only warps these regions of a scan onto the canvas.
+    regions: np.ndarray
+    # (rois, 4) int32 sampling windows, inset from the printed bubbles.
+    rects: np.ndarray
+    # (rois, 4) flat indices into the (height + 1, width + 1) integral image,
+    # ordered so that ``integral[corners] @ [1, -1, -1, 1]`` is the window sum.
+    corners: np.ndarray
+    areas: np.ndarray
+
+    def sample(self, integral: np.ndarray) -> np.ndarray:
+        """Return the ink ratio of every ROI from an integral image of the sheet."""
+        sums = integral.reshape(-1)[self.corners] @ np.array([1, -1, -1, 1], dtype=integral.dtype)
+        return sums / self.areas
+
+    def grid_fill(self, fill: np.ndarray, grid: Grid) -> np.ndarray:
+        return fill[grid.window].reshape(grid.shape)
+
+
+def _grid_boxes(spec: dict, bubble) -> np.ndarray:
+    options = len(str(spec['options']))
+    option_pitch = np.asarray(spec['option_pitch'])
+    group_pitch = np.asarray(spec['group_pitch'])
+    blocks: List[np.ndarray] = []
+    for block in spec['blocks']:
+        groups = np.arange(int(block['groups']))[:, None, None] * group_pitch
+        offsets = np.arange(options)[None, :, None] * option_pitch
+        origin = np.asarray(block['top_left']) + groups + offsets
+        blocks.append(np.concatenate([origin, origin + np.asarray(bubble)], axis=-1))
+    return np.concatenate(blocks, axis=0).astype(np.int32)
+
+
+def _timing_row(spec: dict) -> np.ndarray:
+    count = int(spec['count'])
+    if count < 2:
+        raise ValueError(f'timing row of {count} marks')
+    first, last = (np.asarray(spec[end], dtype=np.float32).reshape(2) for end in ('first', 'last'))
+    centres = np.linspace(first, last, count, dtype=np.float32)
+    centres.setflags(write=False)
+    return centres
+
+
+def compile_layout(key: str, spec: dict) -> SheetLayout:
+    grids: Dict[str, Grid] = {}
+    boxes: List[np.ndarray] = []
+    regions: List[np.ndarray] = []
+    try:
+        width, height = (int(v) for v in spec['size'])
+        bubble = np.asarray(spec['bubble']['size'], dtype=np.float64).reshape(2)
+        inset = float(spec['bubble'].get('inset', 0.0))
+        paper = tuple(float(v) for v in spec['paper']) if 'paper' in spec else None
+        version = int(spec.get('version', 1))
+        threshold = float(spec.get('threshold', 0.5))
+        timing_mark = tuple(float(v) for v in np.asarray(spec['timing']['size']).reshape(2))
+        timing_rows = tuple(_timing_row(row) for row in spec['timing']['rows'])
+        if len(timing_rows) < 2:
+            raise ValueError('registration needs at least two timing rows')
+        start = 0
+        for name in ('items', 'student_id', 'set_code'):
+            grid_spec = spec[name]
+            grid_boxes = _grid_boxes(grid_spec, bubble)
+            stop = start + grid_boxes.shape[0] * grid_boxes.shape[1]
+            grids[name] = Grid(options=str(grid_spec['options']), boxes=grid_boxes, window=slice(start, stop))
+            flat = grid_boxes.reshape(-1, 4)
+            boxes.append(flat)
+            regions.append(np.concatenate([flat[:, :2].min(axis=0) - 1, flat[:, 2:].max(axis=0) + 1]))
+            start = stop
+    except (KeyError, TypeError, ValueError, IndexError) as exc:
+        raise LayoutError(f'Layout {key} is malformed: {exc}') from exc
+
+    dx = int(round(bubble[0] * inset))
+    dy = int(round(bubble[1] * inset))
+    rects = np.concatenate(boxes) + np.asarray([dx, dy, -dx, -dy], dtype=np.int32)
+    if (rects[:, :2] < 0).any() or (rects[:, 2] > width).any() or (rects[:, 3] > height).any():
+        raise LayoutError(f'Layout {key} has bubbles outside the {width}x{height} canvas')
+
+    x0, y0, x1, y1 = rects.T
+    stride = width + 1
+    corners = np.stack([y1 * stride + x1, y0 * stride + x1, y1 * stride + x0, y0 * stride + x0], axis=1).astype(np.intp)
+    areas = ((x1 - x0) * (y1 - y0)).astype(np.float32)
+    regions = np.clip(np.stack(regions), 0, [width, height, width, height]).astype(np.int32)
+    for array in (regions, rects, corners, areas):
+        array.setflags(write=False)
+
+    return SheetLayout(
+        key=key,
+        name=str(spec.get('name', key)),
+        version=version,
+        width=width,
+        height=height,
+        timing_mark=timing_mark,
+        timing_rows=timing_rows,
+        bubble=(int(bubble[0]), int(bubble[1])),
+        paper=paper,
+        threshold=threshold,
+        regions=regions,
+        rects=rects,
+        corners=corners,
+        areas=areas,
+        **grids,
+    )
+
+
+def _layout_dirs() -> List[Path]:
+    from django.conf import settings
+
+    extra = getattr(settings, 'OMR_LAYOUT_DIRS', []) if settings.configured else []
+    return [LAYOUTS_DIR, *(Path(d) for d in extra)]
+
+
+def available_layouts() -> List[str]:
+    keys = {path.stem for directory in _layout_dirs() for path in directory.glob('*.yaml')}
+    return sorted(keys)
+
+
+@lru_cache(maxsize=None)
+def load_layout(key: str = DEFAULT_LAYOUT) -> SheetLayout:
+    for directory in _layout_dirs():
+        path = directory / f'{key}.yaml'
+        if path.exists():
+            with path.open('r', encoding='utf-8') as fh:
+                return compile_layout(key, yaml.safe_load(fh))
+    raise LayoutError(f'Unknown sheet layout {key}')
+
+
+def layout_for_exam(exam) -> SheetLayout:
+    return load_layout(exam.sheet_layout or DEFAULT_LAYOUT)
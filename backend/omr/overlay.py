@@ -1,19 +1,38 @@
+"""Review overlays drawn over scanned sheets, cached by content.
+
+An overlay only depends on the scan image, the answers drawn on it and
+the way it is drawn, so it is stored under a hash of exactly those
+inputs. A cached file is never rewritten: reviewers share it, and new
+answers simply produce a new key. The cache directory is kept under a
+byte budget by evicting the least recently served files.
+"""
 from __future__ import annotations
 
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Iterable
+from typing import BinaryIO, Iterable, Sequence
 
 from PIL import Image, ImageDraw, ImageFont
 
+# Bump both whenever the drawing below changes so stale renders are not
+# served: the version keys the cache and ETag, the date feeds Last-Modified.
+OVERLAY_VERSION = 1
+OVERLAY_UPDATED = datetime(2026, 10, 1, tzinfo=timezone.utc)
+
 
-def build_overlay(image_path: str, answers: Iterable[str]) -> Path:
+def build_overlay(image_path: str, answers: Iterable[str], destination: str | Path | None = None) -> Path:
+    answers = list(answers)
     base = Image.open(image_path).convert('RGB')
     draw = ImageDraw.Draw(base, 'RGBA')
     width, height = base.size
     font = ImageFont.load_default()
 
     columns = 10
-    rows = (len(list(answers)) + columns - 1) // columns or 1
+    rows = (len(answers) + columns - 1) // columns or 1
     cell_w = width / columns
     cell_h = height / rows
     for idx, answer in enumerate(answers):
@@ -24,6 +43,76 @@ def build_overlay(image_path: str, answers: Iterable[str]) -> Path:
         draw.rectangle([x0, y0, x0 + cell_w, y0 + cell_h], outline=(255, 0, 0, 128), width=2)
         draw.text((x0 + 5, y0 + 5), str(answer), fill=(0, 0, 0), font=font)
 
-    overlay_path = Path(image_path).with_suffix('.overlay.png')
-    base.save(overlay_path)
+    overlay_path = Path(destination) if destination else Path(image_path).with_suffix('.overlay.png')
+    base.save(overlay_path, format='PNG')
     return overlay_path
+
+
+def overlay_key(scan_id: int, image_name: str, answers: Sequence[str], layout_key: str, layout_version: int) -> str:
+    payload = json.dumps(
+        [OVERLAY_VERSION, scan_id, image_name, layout_key, layout_version, list(answers)],
+        separators=(',', ':'),
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def _cache_dir() -> Path:
+    from django.conf import settings
+
+    return Path(settings.OVERLAY_CACHE_DIR)
+
+
+def evict_overlays(max_bytes: int, cache_dir: Path | None = None) -> int:
+    """Delete least recently served overlays until the cache fits ``max_bytes``."""
+    cache_dir = cache_dir or _cache_dir()
+    entries = []
+    for path in cache_dir.glob('*/*.png'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+def cached_overlay(key: str, image_path: str, answers: Sequence[str]) -> BinaryIO:
+    """Open the overlay stored under ``key``, rendering it on first use.
+
+    Renders go to a temporary file that is atomically renamed into place,
+    so concurrent requests for the same key never see a partial PNG. The
+    file is returned already open because a concurrent eviction may unlink
+    it at any moment; an open handle keeps it readable until closed.
+    """
+    from django.conf import settings
+
+    cache_dir = _cache_dir()
+    path = cache_dir / key[:2] / f'{key}.png'
+    try:
+        handle = path.open('rb')
+    except FileNotFoundError:
+        pass
+    else:
+        # mtime doubles as the last-served time for eviction.
+        os.utime(handle.fileno())
+        return handle
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    os.close(fd)
+    try:
+        build_overlay(image_path, answers, destination=tmp_name)
+        handle = open(tmp_name, 'rb')
+        os.replace(tmp_name, path)
+    finally:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+    evict_overlays(settings.OVERLAY_CACHE_MAX_BYTES, cache_dir)
+    return handle
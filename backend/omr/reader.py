@@ -1,13 +1,73 @@
-"""Simple OMR extraction pipeline built on top of OpenCV primitives."""
+"""OMR extraction pipeline built on top of OpenCV primitives.
+
+A scan is registered against the canonical canvas of its sheet layout
+(see :mod:`omr.layout`) using the rows of timing marks printed along the
+sheet's edges, its bubble regions are warped onto that canvas and then
+every bubble is sampled at once by gathering from an integral image of
+the sheet's darkness. Answers, the student number and the set code are
+all decoded from that one sample.
+"""
 from __future__ import annotations
 
-import json
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 import cv2  # type: ignore
 import numpy as np
+from PIL import Image
+
+from .layout import DEFAULT_LAYOUT, Grid, SheetLayout, load_layout
+
+MARK_BLANK = 'blank'
+MARK_SINGLE = 'single'
+MARK_MULTIPLE = 'multiple'
+# A clear mark next to a lighter one (an incompletely erased change of answer).
+MARK_ERASED = 'erased'
+# No clear mark but a bubble darker than paper (a light or erased mark).
+MARK_FAINT = 'faint'
+
+# Smallest printed bubble side, in decoded pixels, a reduced decode must keep.
+MIN_DECODED_BUBBLE = 12
+# Decode reductions OpenCV can apply while decoding (DCT scaling for JPEG).
+REDUCED_DECODES = ((4, cv2.IMREAD_REDUCED_GRAYSCALE_4), (2, cv2.IMREAD_REDUCED_GRAYSCALE_2))
+
+# Longest side (px) of the downsampled copy searched for timing marks. At
+# about canvas scale the marks and the gaps between them stay a few pixels wide.
+REGISTRATION_SIZE = 1400
+# Share of each timing row, both end marks included, that must be found.
+MIN_TIMING_MARKS = 0.8
+
+# Last scan-to-canvas homography per (layout, version, image shape), seeding the next search.
+_registration_seeds: Dict[tuple, np.ndarray] = {}
+
+# Smallest gap between paper and ink levels for a sheet's own calibration to be trusted.
+MIN_CONTRAST = 0.25
+
+
+@dataclass
+class ItemMarks:
+    """Per-item detail behind the decoded answers."""
+
+    # (items, options) mean darkness of every answer bubble, 0 = paper, 1 = ink.
+    fill: np.ndarray
+    # Darkness difference between the two darkest options of each item.
+    margin: np.ndarray
+    # One of MARK_BLANK, MARK_SINGLE, MARK_MULTIPLE, MARK_ERASED, MARK_FAINT.
+    status: List[str]
+    confidence: np.ndarray
+    # Sheet-calibrated darkness above which a bubble counts as marked.
+    threshold: float
+
+    def as_json(self) -> Dict[str, object]:
+        return {
+            'threshold': round(self.threshold, 3),
+            'fill': np.round(self.fill, 3).tolist(),
+            'margin': np.round(self.margin, 3).tolist(),
+            'status': self.status,
+            'confidence': np.round(self.confidence, 3).tolist(),
+        }
 
 
 @dataclass
@@ -17,68 +77,404 @@ class OMRResult:
     set_code: str
     confidence: float
     issues: List[str]
+    # Milliseconds spent in each stage of :func:`process_scan`.
+    timings: Dict[str, float] = field(default_factory=dict)
+    marks: Optional[ItemMarks] = None
+    # See :func:`perceptual_hash`.
+    phash: Optional[int] = None
+
+
+class StageTimer:
+    """Records the wall time between successive ``lap`` calls, in ms."""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.timings[stage] = round((now - self._last) * 1000, 3)
+        self._last = now
 
 
 class OMRProcessingError(Exception):
     pass
 
 
-def _load_sidecar_answers(image_path: Path) -> List[str] | None:
-    json_path = image_path.with_suffix('.json')
-    if json_path.exists():
-        with json_path.open('r', encoding='utf-8') as fh:
-            payload = json.load(fh)
-        answers = payload.get('answers')
-        if isinstance(answers, list):
-            return [str(a).upper() for a in answers]
-    return None
+def decode_reduction(path: Path, layout: SheetLayout) -> int:
+    """Choose how much (1, 2 or 4) a scan can be shrunk while decoding.
+
+    Scan pixels per canvas pixel come from the DPI metadata and the layout's
+    paper size when both are known and agree with the image's pixel size
+    (many files carry a placeholder 72 DPI); otherwise from the pixel size.
+    Only the header is read.
+    """
+    try:
+        with Image.open(path) as image:
+            (width, height), dpi = image.size, image.info.get('dpi')
+    except (OSError, ValueError):
+        return 1
+    density = min(width / layout.width, height / layout.height)
+    if dpi and layout.paper and min(dpi) > 0:
+        stated = float(min(dpi)) * max(layout.paper) / max(layout.width, layout.height)
+        if 0.5 * density <= stated <= 1.05 * density:
+            density = stated
+    bubble = min(layout.bubble) * density
+    for factor, _ in REDUCED_DECODES:
+        if bubble / factor >= MIN_DECODED_BUBBLE:
+            return factor
+    return 1
+
+
+def _decode(path: Path, layout: SheetLayout) -> np.ndarray:
+    """Decode straight to grayscale, reduced as far as the layout allows."""
+    flags = dict(REDUCED_DECODES).get(decode_reduction(path, layout), cv2.IMREAD_GRAYSCALE)
+    gray = cv2.imread(str(path), flags)
+    if gray is None:
+        raise OMRProcessingError('Unable to read scan image')
+    return gray
+
+
+def _marks(gray: np.ndarray, size: Tuple[float, float]) -> np.ndarray:
+    """Return the (n, 2) centroids of solid marks of roughly ``size`` (width, height) fully inside ``gray``."""
+    height, width = gray.shape
+    expected_w, expected_h = size
+    # Timing marks are the darkest print on a sheet. Splitting well below the
+    # paper level drops lighter print and pencil, leaving few shapes to measure.
+    cumulative = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel().cumsum()
+    dark, paper = np.searchsorted(cumulative, [0.005 * cumulative[-1], 0.5 * cumulative[-1]])
+    _, binary = cv2.threshold(gray, dark + 0.3 * (paper - dark), 255, cv2.THRESH_BINARY_INV)
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    centres = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if not (0.6 * expected_w <= w <= 1.6 * expected_w + 1 and 0.6 * expected_h <= h <= 1.6 * expected_h + 1):
+            continue
+        if x == 0 or y == 0 or x + w == width or y + h == height:
+            continue
+        # The contour runs through the outer pixel centres of a solid mark;
+        # a slightly rotated bar fills noticeably less of its bounding box.
+        if cv2.contourArea(contour) < 0.6 * (w - 1) * (h - 1):
+            continue
+        centres.append((x + (w - 1) / 2, y + (h - 1) / 2))
+    return np.asarray(centres, dtype=np.float32).reshape(-1, 2)
+
+
+def _index_row(points: np.ndarray, count: int, size: Tuple[float, float]) -> np.ndarray | None:
+    """Number the marks found along one timing row of ``count`` marks.
+
+    Returns their centres as a (count, 2) array, NaN where a mark was not
+    found, or ``None`` unless enough of them lie on one line at a steady
+    pitch with both end marks among them. Stray marks off the line are
+    ignored. The numbering comes from the gaps between marks, so a missing
+    end mark fails the row instead of shifting it.
+    """
+    if len(points) < max(2, MIN_TIMING_MARKS * count):
+        return None
+    tolerance = size[1] / 2
+    # Start from the densest band of rows and let the fitted line follow any skew.
+    ys = points[:, 1]
+    counts = (np.abs(ys[:, None] - ys[None, :]) < 2 * tolerance).sum(axis=1)
+    on_line = np.abs(ys - ys[counts.argmax()]) < 2 * tolerance
+    for _ in range(3):
+        if on_line.sum() < 2:
+            return None
+        vx, vy, x0, y0 = cv2.fitLine(points[on_line], cv2.DIST_L2, 0, 0.01, 0.01).ravel()
+        if vx < 0:
+            vx, vy = -vx, -vy
+        across = (points - (x0, y0)) @ np.float32([-vy, vx])
+        on_line = np.abs(across) < tolerance
+    row = points[on_line]
+    along = (row - (x0, y0)) @ np.float32([vx, vy])
+    order = np.argsort(along)
+    row, gaps = row[order], np.diff(along[order])
+    if len(row) < max(2, MIN_TIMING_MARKS * count):
+        return None
+    # Most gaps span a single mark; missing marks leave whole multiples.
+    pitch = float(np.median(gaps))
+    steps = np.rint(gaps / pitch) if pitch > 0 else np.zeros_like(gaps)
+    if (steps < 1).any() or (np.abs(gaps - steps * pitch) > 0.3 * pitch).any():
+        return None
+    index = np.concatenate([[0], np.cumsum(steps)]).astype(int)
+    if index[-1] != count - 1:
+        return None
+    centres = np.full((count, 2), np.nan, dtype=np.float32)
+    centres[index] = row
+    return centres
+
+
+def _homography(rows: List[np.ndarray], layout: SheetLayout) -> np.ndarray:
+    """Least-squares scan-to-canvas homography over every timing mark found."""
+    scan = np.concatenate(rows)
+    canvas = np.concatenate(layout.timing_rows)
+    found = ~np.isnan(scan[:, 0])
+    matrix, _ = cv2.findHomography(scan[found], canvas[found], 0)
+    if matrix is None:
+        raise OMRProcessingError('Registration marks are ambiguous')
+    return matrix
+
+
+def _search_timing(gray: np.ndarray, layout: SheetLayout, scale: float) -> np.ndarray:
+    """Find every timing row on ``gray``, a scan at about ``scale`` times the canvas, and register it."""
+    height = gray.shape[0]
+    size = (layout.timing_mark[0] * scale, layout.timing_mark[1] * scale)
+    # Each row is looked for in a band around where an unskewed page would put it.
+    margin = 0.15 * height
+    rows = []
+    for centres in layout.timing_rows:
+        top = max(int(centres[:, 1].min() * scale - margin), 0)
+        bottom = min(int(centres[:, 1].max() * scale + margin) + 1, height)
+        row = _index_row(_marks(gray[top:bottom], size), len(centres), size)
+        if row is None:
+            raise OMRProcessingError('Registration marks not found')
+        rows.append(row + (0, top))
+    return _homography(rows, layout)
+
 
+def _track_timing(gray: np.ndarray, layout: SheetLayout, matrix: np.ndarray, size: Tuple[float, float]) -> np.ndarray | None:
+    """Re-register a scan from the timing marks near where ``matrix`` puts them, or ``None`` if they moved."""
+    height, width = gray.shape
+    inverse = np.linalg.inv(matrix)
+    margin = size[1]
+    rows = []
+    for centres in layout.timing_rows:
+        predicted = cv2.perspectiveTransform(centres[None], inverse)[0]
+        x0, y0 = np.maximum(np.floor(predicted.min(axis=0) - margin), 0).astype(int)
+        x1, y1 = np.minimum(np.ceil(predicted.max(axis=0) + margin), (width, height)).astype(int)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        row = _index_row(_marks(gray[y0:y1, x0:x1], size), len(centres), size)
+        if row is None:
+            return None
+        row = row + (x0, y0)
+        pitch = np.linalg.norm(predicted[-1] - predicted[0]) / (len(centres) - 1)
+        found = ~np.isnan(row[:, 0])
+        if (np.linalg.norm(row[found] - predicted[found], axis=1) > pitch / 2).any():
+            return None
+        rows.append(row)
+    return _homography(rows, layout)
 
-def _infer_from_filename(image_path: Path) -> tuple[str, str]:
-    """Extract student number and set code from filename hints."""
-    stem = image_path.stem
-    student = ''
-    set_code = ''
-    for part in stem.split('__'):
-        if part.startswith('student-'):
-            student = part.split('-', 1)[1]
-        if part.startswith('set-'):
-            set_code = part.split('-', 1)[1]
-    return student, set_code
 
+def _find_registration(gray: np.ndarray, layout: SheetLayout) -> np.ndarray:
+    """Return the homography taking scan pixels onto the layout's canvas.
 
-def process_scan(image_path: str) -> OMRResult:
+    It is fitted to every timing mark found along the sheet's edges. Sheets
+    fed in a run land almost where the previous one did, so the marks are
+    first looked for where the last transform for this image size puts them.
+    Otherwise they are searched for on a copy downsampled to
+    ``REGISTRATION_SIZE`` and refined at full resolution.
+    """
+    height, width = gray.shape
+    scale = min(width / layout.width, height / layout.height)
+    size = (layout.timing_mark[0] * scale, layout.timing_mark[1] * scale)
+    key = (layout.key, layout.version, gray.shape)
+    seed = _registration_seeds.get(key)
+    matrix = _track_timing(gray, layout, seed, size) if seed is not None else None
+    if matrix is None:
+        factor = REGISTRATION_SIZE / max(height, width)
+        # Shrinking by less than a quarter costs more than the smaller search saves.
+        factor = 1.0 if factor > 0.75 else factor
+        # Linear decimation aliases fine detail but the timing marks are solid
+        # bars, and it is an order of magnitude cheaper than INTER_AREA here.
+        small = gray if factor == 1.0 else cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_LINEAR)
+        coarse = _search_timing(small, layout, scale * factor) @ np.diag([factor, factor, 1.0])
+        matrix = coarse if factor == 1.0 else _track_timing(gray, layout, coarse, size)
+        if matrix is None:
+            matrix = coarse
+    if len(_registration_seeds) >= 64:
+        _registration_seeds.clear()
+    _registration_seeds[key] = matrix
+    return matrix
+
+
+def _register(gray: np.ndarray, layout: SheetLayout) -> np.ndarray:
+    """Warp the layout's bubble regions of a scan onto a blank canonical canvas."""
+    matrix = _find_registration(gray, layout)
+    sheet = np.full((layout.height, layout.width), 255, dtype=np.uint8)
+    for x0, y0, x1, y1 in layout.regions.tolist():
+        shift = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+        sheet[y0:y1, x0:x1] = cv2.warpPerspective(
+            gray, shift @ matrix, (x1 - x0, y1 - y0),
+            flags=cv2.INTER_AREA, borderValue=255,
+        )
+    return sheet
+
+
+def perceptual_hash(sheet: np.ndarray, layout: SheetLayout) -> int:
+    """Return a 64-bit DCT hash of the bubble grids of a registered sheet, as a signed int.
+
+    Hashing the registered grids rather than the raw page keeps skew out of
+    it and lets the marks, not the printed template every sheet shares,
+    decide the bits: re-scans of one sheet land a few bits apart, different
+    sheets a dozen or more.
+    """
+    x0, y0 = layout.regions[:, :2].min(axis=0)
+    x1, y1 = layout.regions[:, 2:].max(axis=0)
+    small = cv2.resize(sheet[y0:y1, x0:x1], (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].ravel()
+    # The DC term only tracks overall brightness; its bit stays zero.
+    bits = np.concatenate([[False], low[1:] > np.median(low[1:])])
+    return int(np.packbits(bits).view('>i8')[0])
+
+
+def read_fill(sheet: np.ndarray, layout: SheetLayout) -> np.ndarray:
+    """Return the mean darkness (0 = white, 1 = black) of every ROI of ``layout`` on a registered sheet."""
+    darkness = cv2.bitwise_not(sheet)
+    return layout.sample(cv2.integral(darkness, sdepth=cv2.CV_64F)) / 255.0
+
+
+def calibrate(values: np.ndarray, fallback: float) -> Tuple[float, float, float]:
+    """Split bubble darkness values into paper and ink with Otsu's method.
+
+    Returns ``(threshold, paper, ink)`` levels. Sheets whose histogram has
+    no clear second mode (e.g. all blank) fall back to ``fallback``.
+    """
+    values = np.clip(values.ravel(), 0.0, 1.0)
+    hist, edges = np.histogram(values, bins=64, range=(0.0, 1.0))
+    centers = (edges[:-1] + edges[1:]) / 2
+    weight = np.cumsum(hist)[:-1]
+    total_sum = float(hist @ centers)
+    cumulative = np.cumsum(hist * centers)[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        low_mean = cumulative / weight
+        high_mean = (total_sum - cumulative) / (values.size - weight)
+        between = weight * (values.size - weight) * (low_mean - high_mean) ** 2
+    split = int(np.nanargmax(between)) if np.isfinite(between).any() else -1
+    if split >= 0:
+        cut = edges[split + 1]
+        paper = float(values[values < cut].mean())
+        ink = float(values[values >= cut].mean())
+        if ink - paper >= MIN_CONTRAST:
+            # Between-class variance is flat across an empty gap, so settle
+            # midway between the two levels rather than at the gap's lower edge.
+            return (paper + ink) / 2, paper, ink
+    paper = float(np.median(values))
+    return fallback, paper, max(fallback + (fallback - paper), paper + MIN_CONTRAST)
+
+
+def classify_items(
+    fill: np.ndarray, layout: SheetLayout, levels: Tuple[float, float, float],
+) -> Tuple[List[str], ItemMarks]:
+    """Decode answers from item bubble darkness with the sheet's ``levels`` from :func:`calibrate`.
+
+    Each item gets a confidence in [0, 1]: for a single mark, the gap to the
+    runner-up relative to the sheet's paper/ink contrast; for a blank, how
+    far its darkest bubble stays below the threshold; for multiple marks, how
+    far the weaker of the two darkest bubbles clears the threshold.
+    """
+    fill = layout.grid_fill(fill, layout.items)
+    threshold, paper, ink = levels
+    contrast = max(ink - paper, MIN_CONTRAST)
+    faint_level = paper + 0.5 * (threshold - paper)
+
+    ordered = np.sort(fill, axis=1)
+    top, runner_up = ordered[:, -1], ordered[:, -2]
+    margin = top - runner_up
+    counts = (fill >= threshold).sum(axis=1)
+    faint = ((fill >= faint_level) & (fill < threshold)).sum(axis=1)
+
+    status = np.full(fill.shape[0], MARK_BLANK, dtype=object)
+    status[(counts == 0) & (faint > 0)] = MARK_FAINT
+    status[counts == 1] = MARK_SINGLE
+    status[(counts == 1) & (faint > 0)] = MARK_ERASED
+    status[counts > 1] = MARK_MULTIPLE
+
+    confidence = np.where(
+        counts == 1,
+        np.clip(margin / contrast, 0.0, 1.0),
+        np.clip((threshold - top) / max(threshold - paper, 1e-6), 0.0, 1.0),
+    )
+    double = np.clip((runner_up - threshold) / max(ink - threshold, 1e-6), 0.0, 1.0)
+    confidence = np.where(counts > 1, double, confidence)
+
+    letters = np.asarray(list(layout.items.options))[fill.argmax(axis=1)]
+    answers = np.where(counts == 1, letters, '').tolist()
+    marks = ItemMarks(
+        fill=fill.astype(np.float32),
+        margin=margin.astype(np.float32),
+        status=status.tolist(),
+        confidence=confidence.astype(np.float32),
+        threshold=threshold,
+    )
+    return answers, marks
+
+
+def decode_columns(fill: np.ndarray, layout: SheetLayout, grid: Grid, threshold: float) -> Tuple[str, str]:
+    """Read one option per group of ``grid`` (e.g. one digit per ID column).
+
+    Returns ``(value, problem)`` where ``problem`` is ``''``, ``'missing'``
+    when nothing is marked, or ``'invalid'`` when a column holds several
+    marks or a blank column sits between marked ones.
+    """
+    fill = layout.grid_fill(fill, grid)
+    counts = (fill >= threshold).sum(axis=1)
+    marked = np.flatnonzero(counts)
+    if not marked.size:
+        return '', 'missing'
+    if (counts > 1).any() or marked[-1] - marked[0] + 1 != marked.size:
+        return '', 'invalid'
+    letters = np.asarray(list(grid.options))[fill.argmax(axis=1)]
+    return ''.join(letters[marked[0]:marked[-1] + 1]), ''
+
+
+def try_process_scan(
+    image_path: str, layout: str | SheetLayout = DEFAULT_LAYOUT, num_items: int | None = None,
+) -> Tuple[OMRResult | None, str]:
+    """Process-pool friendly :func:`process_scan` returning ``(result, error)``."""
+    try:
+        return process_scan(image_path, layout, num_items), ''
+    except Exception as exc:  # noqa: BLE001 - OpenCV raises plain cv2.error
+        return None, str(exc) or exc.__class__.__name__
+
+
+def process_scan(
+    image_path: str, layout: str | SheetLayout = DEFAULT_LAYOUT, num_items: int | None = None,
+) -> OMRResult:
+    """Read a sheet; only its first ``num_items`` items (default all) count towards issues and confidence."""
     path = Path(image_path)
     if not path.exists():
         raise OMRProcessingError(f'Image {image_path} not found')
 
-    image = cv2.imread(str(path))
-    if image is None:
-        raise OMRProcessingError('Unable to read scan image')
-
-    # Simple pre-processing to simulate deskew/threshold.
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    _ = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                              cv2.THRESH_BINARY_INV, 11, 2)
-
-    answers = _load_sidecar_answers(path) or [''] * 100
-    student, set_code = _infer_from_filename(path)
+    timer = StageTimer()
+    if isinstance(layout, str):
+        layout = load_layout(layout)
+    gray = _decode(path, layout)
+    timer.lap('decode')
+    sheet = _register(gray, layout)
+    timer.lap('register')
+    fill = read_fill(sheet, layout)
+    phash = perceptual_hash(sheet, layout)
+    timer.lap('sample')
+    # One calibration for every grid: the answer bubbles dominate the histogram
+    # and the sparsely marked ID and set-code grids reuse their levels.
+    levels = calibrate(layout.grid_fill(fill, layout.items), layout.threshold)
+    answers, marks = classify_items(fill, layout, levels)
+    student, student_problem = decode_columns(fill, layout, layout.student_id, levels[0])
+    set_code, set_problem = decode_columns(fill, layout, layout.set_code, levels[0])
 
     issues: List[str] = []
-    if not student:
-        issues.append('missing_student_number')
-    if not set_code:
-        issues.append('missing_set_code')
-    if all(a == '' for a in answers):
+    if student_problem:
+        issues.append(f'{student_problem}_student_number')
+    if set_problem:
+        issues.append(f'{set_problem}_set_code')
+    # Items past the exam's length are unused bubbles; their smudges don't matter.
+    used = slice(None, num_items)
+    if MARK_MULTIPLE in marks.status[used]:
+        issues.append('multiple_marks')
+    if all(a == '' for a in answers[used]):
         issues.append('empty_answers')
 
-    confidence = 0.9 if not issues else 0.5
+    # The least certain item bounds how much the sheet as a whole can be trusted.
+    confidence = round(float(marks.confidence[used].min()), 3) if len(answers[used]) else 0.0
+    timer.lap('interpret')
 
     return OMRResult(
         answers=answers,
         student_number=student,
-        set_code=set_code or 'A',
+        set_code=set_code,
         confidence=confidence,
         issues=issues,
+        timings=timer.timings,
+        marks=marks,
+        phash=phash,
     )
@@ -0,0 +1,80 @@
+"""Downscaled renditions of a scan for the review UI.
+
+Each scan gets a small thumbnail, a medium preview and a Deep Zoom style
+tile pyramid: level ``levels - 1`` is the full-resolution sheet and every
+level below halves it, down to a single pixel. Tiles are named
+``tiles/{level}/{column}_{row}.webp``.
+"""
+from __future__ import annotations
+
+import math
+from pathlib import Path
+from typing import Dict
+
+from PIL import Image
+
+THUMBNAIL_SIZE = 320
+PREVIEW_SIZE = 1200
+TILE_SIZE = 512
+FORMAT = 'webp'
+QUALITY = 80
+
+
+def _save(image: Image.Image, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    image.save(path, format=FORMAT, quality=QUALITY, method=4)
+
+
+def _downscaled(image: Image.Image, size: int) -> Image.Image:
+    copy = image.copy()
+    copy.thumbnail((size, size), Image.Resampling.LANCZOS)
+    return copy
+
+
+def _tiles(image: Image.Image, out_dir: Path) -> int:
+    width, height = image.size
+    levels = math.ceil(math.log2(max(width, height))) + 1
+    level_image = image
+    for level in range(levels - 1, -1, -1):
+        w, h = level_image.size
+        for column in range(math.ceil(w / TILE_SIZE)):
+            for row in range(math.ceil(h / TILE_SIZE)):
+                box = (column * TILE_SIZE, row * TILE_SIZE, min(w, (column + 1) * TILE_SIZE), min(h, (row + 1) * TILE_SIZE))
+                _save(level_image.crop(box), out_dir / 'tiles' / str(level) / f'{column}_{row}.{FORMAT}')
+        if level:
+            level_image = level_image.resize((max(1, math.ceil(w / 2)), max(1, math.ceil(h / 2))), Image.Resampling.BOX)
+    return levels
+
+
+def build_renditions(image_path: str, out_dir: str) -> Dict[str, object]:
+    """Write the renditions of ``image_path`` under ``out_dir``.
+
+    Returns a manifest with paths relative to ``out_dir``.
+    """
+    out = Path(out_dir)
+    with Image.open(image_path) as source:
+        source.draft('L', source.size)
+        image = source.convert('L')
+    _save(_downscaled(image, THUMBNAIL_SIZE), out / f'thumbnail.{FORMAT}')
+    _save(_downscaled(image, PREVIEW_SIZE), out / f'preview.{FORMAT}')
+    levels = _tiles(image, out)
+    return {
+        'thumbnail': f'thumbnail.{FORMAT}',
+        'preview': f'preview.{FORMAT}',
+        'tiles': {
+            'path': 'tiles',
+            'format': FORMAT,
+            'tile_size': TILE_SIZE,
+            'levels': levels,
+            'width': image.width,
+            'height': image.height,
+        },
+    }
+
+
+def try_build_renditions(image_path: str, out_dir: str) -> Dict[str, object]:
+    """Process-pool friendly :func:`build_renditions`; an unreadable image yields ``{}``."""
+    try:
+        return build_renditions(image_path, out_dir)
+    except (OSError, ValueError):
+        return {}
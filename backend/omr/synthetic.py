@@ -0,0 +1,96 @@
+"""Render synthetic answer sheets for a compiled sheet layout.
+
+Used by the tests to exercise the reader end to end without shipping
+binary fixtures.
+"""
+from __future__ import annotations
+
+from typing import Mapping, Sequence
+
+import cv2  # type: ignore
+import numpy as np
+
+from .layout import DEFAULT_LAYOUT, Grid, SheetLayout, load_layout
+
+OUTLINE = 170
+INK = 30
+# What is left of a mark after a rubber has been over it.
+ERASED = 185
+
+
+def _draw_grid(sheet: np.ndarray, grid: Grid, values: Sequence[str]) -> None:
+    for group, row in enumerate(grid.boxes):
+        given = values[group] if group < len(values) else ''
+        for option, (x0, y0, x1, y1) in enumerate(row):
+            cv2.rectangle(sheet, (int(x0), int(y0)), (int(x1), int(y1)), OUTLINE, thickness=1)
+            if grid.options[option] in given:
+                cv2.rectangle(sheet, (int(x0), int(y0)), (int(x1), int(y1)), INK, thickness=-1)
+
+
+def render_sheet(
+    answers: Sequence[str],
+    *,
+    student_number: str = '',
+    set_code: str = '',
+    layout: str | SheetLayout = DEFAULT_LAYOUT,
+    scale: float = 1.0,
+    erased: Mapping[int, str] | None = None,
+) -> np.ndarray:
+    """Return a grayscale sheet with the given bubbles shaded, optionally rescaled.
+
+    ``erased`` maps item indexes to options left with an erased mark.
+    """
+    if isinstance(layout, str):
+        layout = load_layout(layout)
+    sheet = np.full((layout.height, layout.width), 255, dtype=np.uint8)
+
+    half_width, half_height = (size / 2 for size in layout.timing_mark)
+    for row in layout.timing_rows:
+        for cx, cy in row:
+            top_left = (int(round(cx - half_width)), int(round(cy - half_height)))
+            bottom_right = (int(round(cx + half_width)) - 1, int(round(cy + half_height)) - 1)
+            cv2.rectangle(sheet, top_left, bottom_right, 0, thickness=-1)
+
+    _draw_grid(sheet, layout.items, answers)
+    for item, options in (erased or {}).items():
+        for option in options:
+            x0, y0, x1, y1 = (int(v) for v in layout.items.boxes[item, layout.items.options.index(option)])
+            cv2.rectangle(sheet, (x0, y0), (x1, y1), ERASED, thickness=-1)
+    _draw_grid(sheet, layout.student_id, list(student_number))
+    _draw_grid(sheet, layout.set_code, [set_code])
+
+    if scale != 1.0:
+        size = (int(round(layout.width * scale)), int(round(layout.height * scale)))
+        sheet = cv2.resize(sheet, size, interpolation=cv2.INTER_AREA)
+    return sheet
+
+
+def degrade_sheet(
+    sheet: np.ndarray,
+    *,
+    angle: float = 0.0,
+    shift: tuple[float, float] = (0.0, 0.0),
+    noise: float = 0.0,
+    blur: int = 0,
+    margin: int = 0,
+    seed: int | None = None,
+) -> np.ndarray:
+    """Make a rendered sheet look scanned: skew, offset, blur and sensor noise.
+
+    ``margin`` pads the page with white first so skewed corners stay in view;
+    ``noise`` is the standard deviation of additive Gaussian noise in grey levels.
+    """
+    rng = np.random.default_rng(seed)
+    if margin:
+        sheet = cv2.copyMakeBorder(sheet, margin, margin, margin, margin, cv2.BORDER_CONSTANT, value=255)
+    height, width = sheet.shape[:2]
+    if angle or shift != (0.0, 0.0):
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        matrix[:, 2] += shift
+        sheet = cv2.warpAffine(sheet, matrix, (width, height), flags=cv2.INTER_LINEAR, borderValue=255)
+    if blur:
+        sheet = cv2.GaussianBlur(sheet, (blur * 2 + 1, blur * 2 + 1), 0)
+    if noise:
+        noisy = sheet.astype(np.float32) + rng.normal(0.0, noise, sheet.shape).astype(np.float32)
+        sheet = np.clip(noisy, 0, 255).astype(np.uint8)
+    return sheet
@@ -113,5 +113,40 @@ SIMPLE_JWT = {
 CORS_ALLOW_ALL_ORIGINS = DEBUG
 CORS_ALLOWED_ORIGINS = os.environ.get('CORS_ALLOWED_ORIGINS', '').split(',') if not DEBUG else []
 
+# Seconds a stale discrimination index may be served before the exam's
+# analytics snapshot is rebuilt on read.
+ANALYTICS_DISCRIMINATION_MAX_AGE = int(os.environ.get('ANALYTICS_DISCRIMINATION_MAX_AGE', '300'))
+
+# Answer keys are cached per exam in each process (LRU of this many exams).
+# Their version stamps, bumped whenever a set is saved or deleted, live in
+# this Django cache; it must be shared (e.g. Redis) by every web and worker
+# process for their copies to stay current.
+ANSWER_KEY_CACHE_SIZE = int(os.environ.get('ANSWER_KEY_CACHE_SIZE', '256'))
+ANSWER_KEY_CACHE_ALIAS = os.environ.get('ANSWER_KEY_CACHE_ALIAS', 'default')
+
+# Upper bound on the number of pages a single bulk scan upload may expand to.
+SCAN_BATCH_MAX_PAGES = int(os.environ.get('SCAN_BATCH_MAX_PAGES', '2000'))
+
+# Rendered review overlays are cached here and trimmed to the byte budget.
+OVERLAY_CACHE_DIR = os.environ.get('OVERLAY_CACHE_DIR', str(MEDIA_ROOT / 'overlays'))
+OVERLAY_CACHE_MAX_BYTES = int(os.environ.get('OVERLAY_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+# Scans processed within this many seconds feed the stage timing percentiles
+# of /api/metrics. Scrapers send "Authorization: Bearer <METRICS_TOKEN>";
+# without it only admins may read the endpoint unless METRICS_PUBLIC=1.
+METRICS_WINDOW = int(os.environ.get('METRICS_WINDOW', str(24 * 60 * 60)))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', '0') == '1'
+
+# Scans whose least certain item falls below this confidence (0-1) go to review.
+OMR_REVIEW_CONFIDENCE = float(os.environ.get('OMR_REVIEW_CONFIDENCE', '0.5'))
+
+# Scans whose perceptual hash is within this many bits (of 64) of an earlier
+# scan of the same exam and student are flagged possible_duplicate instead of scored.
+SCAN_DUPLICATE_DISTANCE = int(os.environ.get('SCAN_DUPLICATE_DISTANCE', '6'))
+
+# Extra directories searched for sheet layout YAML files (see omr/layout.py).
+OMR_LAYOUT_DIRS = [d for d in os.environ.get('OMR_LAYOUT_DIRS', '').split(',') if d]
+
 ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD')
@@ -8,6 +8,7 @@ from accounts.views import AuthTokenObtainPairView, AuthTokenRefreshView, MeView
 from core.urls import router as core_router
 from exams.urls import router as exams_router
 from scans.urls import router as scans_router
+from scans.views import MetricsView
 from analysis.urls import urlpatterns as analysis_urls
 
 router = routers.DefaultRouter()
@@ -20,6 +21,7 @@ urlpatterns = [
     path('api/auth/token/', AuthTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/auth/token/refresh/', AuthTokenRefreshView.as_view(), name='token_refresh'),
     path('api/auth/me/', MeView.as_view(), name='auth_me'),
+    path('api/metrics', MetricsView.as_view(), name='metrics'),
     path('api/', include(router.urls)),
     path('api/analysis/', include((analysis_urls, 'analysis'))),
 ]
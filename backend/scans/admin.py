@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Scan
+from .models import Scan, ScanJob
 
 
 @admin.register(Scan)
@@ -8,3 +8,9 @@ class ScanAdmin(admin.ModelAdmin):
     list_display = ('exam', 'student', 'status', 'confidence', 'created_at')
     list_filter = ('status', 'exam')
     search_fields = ('extracted_student_number',)
+
+
+@admin.register(ScanJob)
+class ScanJobAdmin(admin.ModelAdmin):
+    list_display = ('scan', 'status', 'attempts', 'locked_at', 'finished_at')
+    list_filter = ('status',)
@@ -0,0 +1,98 @@
+"""Split scanner deliverables (ZIP archives, multi-page PDF/TIFF) into page images.
+
+Every helper works from a file already on disk and yields one page at a
+time, so an archive of hundreds of sheets never has to fit in memory.
+"""
+from __future__ import annotations
+
+import io
+import shutil
+import tempfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import IO, Iterator, Tuple
+
+from PIL import Image, ImageSequence
+
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+TIFF_SUFFIXES = {'.tif', '.tiff'}
+PDF_RENDER_DPI = 200
+
+Page = Tuple[str, IO[bytes]]
+
+
+class UnsupportedUpload(Exception):
+    pass
+
+
+def _png(image: Image.Image, dpi=None) -> io.BytesIO:
+    # Keep the resolution so the reader can pick a reduced decode (see omr.reader.decode_reduction).
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', **({'dpi': dpi} if dpi else {}))
+    buffer.seek(0)
+    return buffer
+
+
+def _tiff_pages(stem: str, fh: IO[bytes]) -> Iterator[Page]:
+    with Image.open(fh) as tiff:
+        for number, frame in enumerate(ImageSequence.Iterator(tiff), start=1):
+            yield f'{stem}-p{number:03d}.png', _png(frame.convert('L'), tiff.info.get('dpi'))
+
+
+def _pdf_pages(stem: str, fh: IO[bytes]) -> Iterator[Page]:
+    try:
+        import pypdfium2 as pdfium
+    except ImportError as exc:  # pragma: no cover - depends on deployment
+        raise UnsupportedUpload('PDF uploads require pypdfium2') from exc
+
+    document = pdfium.PdfDocument(fh)
+    try:
+        for number in range(len(document)):
+            page = document[number]
+            bitmap = page.render(scale=PDF_RENDER_DPI / 72, grayscale=True)
+            yield f'{stem}-p{number + 1:03d}.png', _png(bitmap.to_pil(), (PDF_RENDER_DPI, PDF_RENDER_DPI))
+            page.close()
+    finally:
+        document.close()
+
+
+def _pages_from_stream(name: str, fh: IO[bytes]) -> Iterator[Page]:
+    path = PurePosixPath(name)
+    suffix = path.suffix.lower()
+    if suffix in IMAGE_SUFFIXES:
+        yield path.name, fh
+    elif suffix in TIFF_SUFFIXES:
+        yield from _tiff_pages(path.stem, fh)
+    elif suffix == '.pdf':
+        yield from _pdf_pages(path.stem, fh)
+    else:
+        raise UnsupportedUpload(f'Unsupported file type: {path.name}')
+
+
+def _zip_pages(archive: Path) -> Iterator[Page]:
+    with zipfile.ZipFile(archive) as zf:
+        for member in zf.infolist():
+            name = PurePosixPath(member.filename)
+            if member.is_dir() or name.name.startswith('.') or '__MACOSX' in name.parts:
+                continue
+            suffix = name.suffix.lower()
+            if suffix not in IMAGE_SUFFIXES | TIFF_SUFFIXES | {'.pdf'}:
+                continue
+            with zf.open(member) as fh:
+                if suffix in IMAGE_SUFFIXES:
+                    yield name.name, fh
+                    continue
+                # PDF and TIFF readers need random access; spill to disk.
+                with tempfile.TemporaryFile() as spool:
+                    shutil.copyfileobj(fh, spool)
+                    spool.seek(0)
+                    yield from _pages_from_stream(name.name, spool)
+
+
+def iter_pages(path: Path, original_name: str) -> Iterator[Page]:
+    """Yield ``(filename, stream)`` for every sheet image contained in an upload."""
+    if zipfile.is_zipfile(path):
+        yield from _zip_pages(path)
+        return
+    with open(path, 'rb') as fh:
+        yield from _pages_from_stream(original_name, fh)
@@ -0,0 +1,91 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.models import Batch, Student
+from exams.models import Exam, Score
+from scans.models import Scan
+
+CHUNK_SIZE = 10000
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway exam with many scans and print query plans for the hot scan and score '
+        'queries with and without the composite indexes. Everything is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scans', type=int, default=1_000_000)
+        parser.add_argument('--exams', type=int, default=20, help='Exams the scans are spread over.')
+        parser.add_argument('--review-ratio', type=float, default=0.02, help='Share of scans left in needs_review.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                target = self._seed(options['scans'], max(1, options['exams']), options['review_ratio'])
+                self._report('with indexes', target)
+                with connection.cursor() as cursor:
+                    for model in (Scan, Score):
+                        for index in model._meta.indexes:
+                            cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+                self._analyze()
+                self._report('without indexes', target)
+                raise _Rollback
+        except _Rollback:
+            self.stdout.write('Seeded rows and dropped indexes rolled back')
+
+    def _seed(self, total, exams, review_ratio):
+        started = time.perf_counter()
+        batch = Batch.objects.create(name='Query plan benchmark', code=f'bench-{uuid.uuid4().hex[:8]}')
+        exam_rows = Exam.objects.bulk_create([Exam(batch=batch, title=f'Bench {i}') for i in range(exams)])
+        students = Student.objects.bulk_create([
+            Student(batch=batch, student_number=f'{i:07d}', full_name=f'Student {i}') for i in range(total // exams + 1)
+        ], batch_size=CHUNK_SIZE)
+        review_every = max(1, round(1 / review_ratio)) if review_ratio > 0 else 0
+        for start in range(0, total, CHUNK_SIZE):
+            Scan.objects.bulk_create([
+                Scan(
+                    exam=exam_rows[n % exams],
+                    student=students[n // exams],
+                    image=f'scans/bench/{n}.png',
+                    status=Scan.STATUS_NEEDS_REVIEW if review_every and n % review_every == 0 else Scan.STATUS_PROCESSED,
+                )
+                for n in range(start, min(total, start + CHUNK_SIZE))
+            ])
+        for exam in exam_rows:
+            Score.objects.bulk_create([
+                Score(exam=exam, student=student, set_code='A', raw_score=0, percent=0) for student in students
+            ], batch_size=CHUNK_SIZE)
+        self._analyze()
+        self.stdout.write(f'Seeded {total} scans over {exams} exams in {time.perf_counter() - started:.1f}s')
+        return exam_rows[0]
+
+    def _analyze(self):
+        if connection.vendor in {'postgresql', 'sqlite'}:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def _report(self, label, exam):
+        queries = {
+            'review queue': Scan.objects.filter(exam=exam, status__in=[Scan.STATUS_PENDING, Scan.STATUS_NEEDS_REVIEW]).order_by('-id')[:100],
+            'scans by status': Scan.objects.filter(exam=exam, status=Scan.STATUS_PROCESSED).order_by('-id')[:100],
+            'scans newest first': Scan.objects.filter(exam=exam).order_by('-created_at')[:100],
+            'scores by exam': Score.objects.filter(exam=exam).order_by('-updated_at')[:100],
+            'student match': Student.objects.filter(batch_id=exam.batch_id, student_number__in=['0000001', '0000500']),
+        }
+        analyze = connection.vendor == 'postgresql'
+        self.stdout.write(self.style.MIGRATE_HEADING(f'== {label} =='))
+        for name, queryset in queries.items():
+            plan = queryset.explain(analyze=True) if analyze else queryset.explain()
+            started = time.perf_counter()
+            list(queryset)
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stdout.write(f'-- {name} ({elapsed:.1f} ms)')
+            self.stdout.write(plan)
@@ -0,0 +1,33 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from scans.services import run_jobs
+
+
+class Command(BaseCommand):
+    help = 'Drain the scan processing queue using a pool of OMR worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--batch-size', type=int, default=32)
+        parser.add_argument('--poll-interval', type=float, default=2.0)
+        parser.add_argument('--once', action='store_true', help='Exit as soon as the queue is empty.')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        batch_size = max(1, options['batch_size'])
+        total = 0
+        self.stdout.write(f'OMR worker started with {workers} processes')
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                claimed = run_jobs(batch_size, executor=pool)
+                total += claimed
+                if claimed:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} scans'))
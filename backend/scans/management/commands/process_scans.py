@@ -0,0 +1,71 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from exams.models import Exam
+from scans.models import Scan
+from scans.services import apply_repeats, apply_results, read_scans, render_or_record, split_repeats
+
+
+class Command(BaseCommand):
+    help = 'Re-read stored scans across a pool of worker processes and write the results in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exam', type=int, help='Reprocess every scan of this exam.')
+        parser.add_argument(
+            '--status',
+            nargs='+',
+            default=None,
+            choices=[choice for choice, _ in Scan.STATUS_CHOICES],
+            help='Only reprocess scans in these states (default: pending and needs_review without --exam).',
+        )
+        parser.add_argument(
+            '--include-reviewed',
+            action='store_true',
+            help="Also re-read scans a reviewer has corrected, replacing the reviewer's result.",
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=200, help='Scans written per database round trip.')
+
+    def handle(self, *args, **options):
+        queryset = Scan.objects.select_related('exam').order_by('id')
+        if options['exam']:
+            if not Exam.objects.filter(pk=options['exam']).exists():
+                raise CommandError(f"Exam {options['exam']} does not exist")
+            queryset = queryset.filter(exam_id=options['exam'])
+        statuses = options['status'] or (None if options['exam'] else [Scan.STATUS_PENDING, Scan.STATUS_NEEDS_REVIEW])
+        if statuses:
+            queryset = queryset.filter(status__in=statuses)
+        if not options['include_reviewed']:
+            queryset = queryset.filter(reviewed_at__isnull=True)
+
+        scans = list(queryset)
+        if not scans:
+            self.stdout.write('No scans to process')
+            return
+
+        workers = max(1, options['workers'])
+        chunk_size = max(1, options['chunk_size'])
+        started = time.perf_counter()
+        # Exact repeats take their original's fresh result instead of a read of their own.
+        fresh, repeats = split_repeats(scans)
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outcomes = read_scans(fresh, executor=pool)
+            while done < len(fresh):
+                chunk = fresh[done:done + chunk_size]
+                apply_results(list(zip(chunk, islice(outcomes, len(chunk)))))
+                render_or_record(chunk, pool)
+                done += len(chunk)
+                self.stdout.write(f'{done}/{len(fresh)} scans written')
+            apply_repeats(repeats)
+            render_or_record([scan for scan, _ in repeats], pool)
+        done += len(repeats)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {done} scans with {workers} workers in {elapsed:.1f}s ({done / elapsed:.1f} scans/s)'
+        ))
@@ -0,0 +1,71 @@
+"""Pipeline stage timings aggregated per exam, and their Prometheus exposition."""
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Scan, ScanJob
+
+QUANTILES = (0.5, 0.95)
+
+# {exam_id: {stage: [ms, ...]}}
+StageSamples = Dict[int, Dict[str, List[float]]]
+
+
+def stage_samples(exam_id: Optional[int] = None) -> StageSamples:
+    """Collect stage timings of scans processed within ``settings.METRICS_WINDOW``."""
+    since = timezone.now() - timedelta(seconds=settings.METRICS_WINDOW)
+    queryset = Scan.objects.filter(updated_at__gte=since).exclude(timings={})
+    if exam_id is not None:
+        queryset = queryset.filter(exam_id=exam_id)
+    samples: StageSamples = defaultdict(lambda: defaultdict(list))
+    for scan_exam_id, timings in queryset.values_list('exam_id', 'timings').iterator(chunk_size=2000):
+        for stage, ms in timings.items():
+            samples[scan_exam_id][stage].append(ms)
+    return samples
+
+
+def stage_summary(samples: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    """Return count, p50, p95 and total (ms) per stage."""
+    summary = {}
+    for stage, values in sorted(samples.items()):
+        array = np.asarray(values, dtype=np.float64)
+        p50, p95 = np.percentile(array, [q * 100 for q in QUANTILES])
+        summary[stage] = {
+            'count': int(array.size),
+            'p50_ms': round(float(p50), 3),
+            'p95_ms': round(float(p95), 3),
+            'total_ms': round(float(array.sum()), 3),
+        }
+    return summary
+
+
+def prometheus_text() -> str:
+    lines = [
+        '# HELP omr_scan_stage_seconds Time spent per scan in each pipeline stage.',
+        '# TYPE omr_scan_stage_seconds summary',
+    ]
+    for exam_id, stages in sorted(stage_samples().items()):
+        for stage, summary in stage_summary(stages).items():
+            labels = f'exam="{exam_id}",stage="{stage}"'
+            for quantile in QUANTILES:
+                value = summary[f'p{int(quantile * 100)}_ms'] / 1000
+                lines.append(f'omr_scan_stage_seconds{{{labels},quantile="{quantile}"}} {value:.6f}')
+            lines.append(f'omr_scan_stage_seconds_sum{{{labels}}} {summary["total_ms"] / 1000:.6f}')
+            lines.append(f'omr_scan_stage_seconds_count{{{labels}}} {summary["count"]}')
+
+    lines += ['# HELP omr_scans Scans by exam and status.', '# TYPE omr_scans gauge']
+    for exam_id, status, count in Scan.objects.values_list('exam_id', 'status').annotate(n=Count('id')).order_by('exam_id', 'status'):
+        lines.append(f'omr_scans{{exam="{exam_id}",status="{status}"}} {count}')
+
+    lines += ['# HELP omr_scan_jobs Queue entries by status.', '# TYPE omr_scan_jobs gauge']
+    counts = dict(ScanJob.objects.values_list('status').annotate(n=Count('id')).order_by())
+    for status, _ in ScanJob.STATUS_CHOICES:
+        lines.append(f'omr_scan_jobs{{status="{status}"}} {counts.get(status, 0)}')
+    return '\n'.join(lines) + '\n'
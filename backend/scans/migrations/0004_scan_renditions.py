@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0003_scanbatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scan',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
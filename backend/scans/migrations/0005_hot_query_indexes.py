@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        ('exams', '0004_hot_query_indexes'),
+        ('scans', '0004_scan_renditions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scan',
+            index=models.Index(fields=['exam', 'status', '-id'], name='scan_exam_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scan',
+            index=models.Index(fields=['exam', '-created_at'], name='scan_exam_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scan',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'needs_review'])), fields=['exam', '-id'], name='scan_open_idx'),
+        ),
+    ]
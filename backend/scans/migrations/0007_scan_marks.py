@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0006_scan_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scan',
+            name='marks',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        ('exams', '0004_hot_query_indexes'),
+        ('scans', '0007_scan_marks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scan',
+            name='content_digest',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='scans.scan'),
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='phash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='scan',
+            index=models.Index(fields=['exam', 'content_digest'], name='scan_exam_digest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scan',
+            index=models.Index(fields=['exam', 'extracted_student_number', 'phash'], name='scan_exam_student_phash_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0008_scan_duplicates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scan',
+            name='reviewed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
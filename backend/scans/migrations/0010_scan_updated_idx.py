@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        ('exams', '0005_examset_updated_at'),
+        ('scans', '0009_scan_reviewed_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scan',
+            index=models.Index(fields=['updated_at'], name='scan_updated_idx'),
+        ),
+    ]
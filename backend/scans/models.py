@@ -10,8 +10,22 @@ from exams.models import Exam
 
 
 def scan_upload_path(instance, filename):
-    ext = Path(filename).suffix
-    return f"scans/{instance.exam_id}/{uuid.uuid4()}{ext}"
+    # Keep the original stem so reviewers can match a scan to the scanner's file.
+    path = Path(filename)
+    return f"scans/{instance.exam_id}/{uuid.uuid4().hex}__{path.stem}{path.suffix}"
+
+
+class ScanBatch(models.Model):
+    """A single bulk upload (archive or multi-page document) split into scans."""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    exam = models.ForeignKey(Exam, on_delete=models.CASCADE, related_name='scan_batches')
+    source_name = models.CharField(max_length=255, blank=True)
+    total = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
 
 
 class Scan(models.Model):
@@ -26,18 +40,57 @@ class Scan(models.Model):
 
     exam = models.ForeignKey(Exam, on_delete=models.CASCADE, related_name='scans')
     student = models.ForeignKey(Student, on_delete=models.SET_NULL, related_name='scans', null=True, blank=True)
+    batch = models.ForeignKey(ScanBatch, on_delete=models.SET_NULL, related_name='scans', null=True, blank=True)
     image = models.ImageField(upload_to=scan_upload_path)
+    # SHA-256 of the uploaded file; a repeat upload reuses the earlier scan's result.
+    content_digest = models.CharField(max_length=64, blank=True)
+    # Perceptual hash of the registered bubble grids (see omr.reader.perceptual_hash).
+    phash = models.BigIntegerField(null=True, blank=True)
+    # The earlier scan of the same sheet, for exact repeats and flagged near-duplicates.
+    duplicate_of = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, related_name='duplicates', null=True, blank=True,
+    )
     extracted_student_number = models.CharField(max_length=50, blank=True)
     extracted_set_code = models.CharField(max_length=10, blank=True)
     answers = models.JSONField(default=list, blank=True)
     confidence = models.FloatField(default=0.0)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
     issues = models.JSONField(default=list, blank=True)
+    # Per-item bubble darkness, mark status and confidence from the reader (see omr/reader.py).
+    marks = models.JSONField(default=dict, blank=True)
+    # Thumbnail, preview and tile pyramid paths in storage (see omr/renditions.py).
+    renditions = models.JSONField(default=dict, blank=True)
+    # Milliseconds per pipeline stage of the last processing run (see scans/metrics.py).
+    timings = models.JSONField(default=dict, blank=True)
+    # Set when a reviewer enters the result by hand; re-reading the sheet clears it.
+    reviewed_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    PROCESSED_FIELDS = [
+        'student', 'extracted_student_number', 'extracted_set_code', 'answers',
+        'confidence', 'marks', 'status', 'issues', 'timings', 'updated_at',
+        'phash', 'duplicate_of', 'reviewed_at',
+    ]
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Scan lists and the review queue: one exam, newest first, optionally by status.
+            models.Index(fields=['exam', 'status', '-id'], name='scan_exam_status_idx'),
+            models.Index(fields=['exam', '-created_at'], name='scan_exam_created_idx'),
+            # Duplicate checks before and after reading a sheet.
+            models.Index(fields=['exam', 'content_digest'], name='scan_exam_digest_idx'),
+            models.Index(fields=['exam', 'extracted_student_number', 'phash'], name='scan_exam_student_phash_idx'),
+            # Stage timings of recently processed scans (scans/metrics.py).
+            models.Index(fields=['updated_at'], name='scan_updated_idx'),
+            # Unfinished scans are a small fraction of the table once an exam is graded.
+            models.Index(
+                fields=['exam', '-id'],
+                condition=models.Q(status__in=['pending', 'needs_review']),
+                name='scan_open_idx',
+            ),
+        ]
 
     def mark_processed(
         self,
@@ -48,12 +101,48 @@ class Scan(models.Model):
         answers,
         confidence: float,
         issues=None,
+        marks=None,
+        reviewed_at=None,
+        commit: bool = True,
     ):
         self.student = student
         self.extracted_student_number = extracted_student_number
         self.extracted_set_code = set_code
         self.answers = answers
         self.confidence = confidence
+        if marks is not None:
+            self.marks = marks
         self.status = self.STATUS_PROCESSED if not issues else self.STATUS_NEEDS_REVIEW
         self.issues = issues or []
-        self.save(update_fields=['student', 'extracted_student_number', 'extracted_set_code', 'answers', 'confidence', 'status', 'issues', 'updated_at'])
+        self.reviewed_at = reviewed_at
+        if commit:
+            self.save(update_fields=self.PROCESSED_FIELDS)
+
+
+class ScanJob(models.Model):
+    """Queue entry asking an ``omr_worker`` to read a scan."""
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    scan = models.ForeignKey(Scan, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='scanjob_status_idx'),
+        ]
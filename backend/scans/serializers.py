@@ -1,13 +1,20 @@
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 
+from core.api import SparseFieldsMixin
 from core.serializers import StudentSerializer
+from exams.models import Exam
 from exams.serializers import ExamSerializer
-from .models import Scan
+from .models import Scan, ScanBatch
+from .services import batch_progress
 
 
-class ScanSerializer(serializers.ModelSerializer):
+class ScanSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     exam_detail = ExamSerializer(source='exam', read_only=True)
     student_detail = StudentSerializer(source='student', read_only=True)
+    thumbnail = serializers.SerializerMethodField()
+    preview = serializers.SerializerMethodField()
+    tiles = serializers.SerializerMethodField()
 
     class Meta:
         model = Scan
@@ -18,12 +25,18 @@ class ScanSerializer(serializers.ModelSerializer):
             'student',
             'student_detail',
             'image',
+            'thumbnail',
+            'preview',
+            'tiles',
             'extracted_student_number',
             'extracted_set_code',
             'answers',
             'confidence',
+            'marks',
             'status',
             'issues',
+            'duplicate_of',
+            'reviewed_at',
             'created_at',
             'updated_at',
         ]
@@ -32,8 +45,50 @@ class ScanSerializer(serializers.ModelSerializer):
             'extracted_set_code',
             'answers',
             'confidence',
+            'marks',
             'status',
             'issues',
+            'duplicate_of',
+            'reviewed_at',
             'created_at',
             'updated_at',
         ]
+        list_exclude = ['exam_detail', 'answers', 'marks', 'tiles']
+
+    def _url(self, name: str) -> str:
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_thumbnail(self, obj):
+        name = obj.renditions.get('thumbnail')
+        return self._url(name) if name else None
+
+    def get_preview(self, obj):
+        name = obj.renditions.get('preview')
+        return self._url(name) if name else None
+
+    def get_tiles(self, obj):
+        tiles = obj.renditions.get('tiles')
+        if not tiles:
+            return None
+        info = {key: value for key, value in tiles.items() if key != 'path'}
+        info['url'] = self._url(tiles['path']) + '/{level}/{column}_{row}.' + tiles['format']
+        return info
+
+
+class ScanBatchSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ScanBatch
+        fields = ['id', 'exam', 'source_name', 'total', 'progress', 'created_at']
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        return batch_progress(obj)
+
+
+class ScanBatchUploadSerializer(serializers.Serializer):
+    exam = serializers.PrimaryKeyRelatedField(queryset=Exam.objects.all())
+    files = serializers.ListField(child=serializers.FileField(), allow_empty=False)
@@ -0,0 +1,421 @@
+from __future__ import annotations
+
+import hashlib
+import time
+from collections import defaultdict
+from concurrent.futures import Executor
+from datetime import timedelta
+from pathlib import Path
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from core.models import Student
+from exams.models import Exam
+from exams.services import upsert_scores
+from omr.reader import OMRResult, try_process_scan
+from omr.renditions import try_build_renditions
+from .ingest import UnsupportedUpload, iter_pages
+from .models import Scan, ScanBatch, ScanJob, scan_upload_path
+
+MAX_ATTEMPTS = 3
+STALE_AFTER = timedelta(minutes=10)
+
+Outcome = Tuple[Optional[OMRResult], str]
+# Per-scan stage timings in ms, keyed by scan id.
+Timings = Dict[int, Dict[str, float]]
+# Fields a repeat upload takes over from the scan it repeats.
+REPEAT_FIELDS = [
+    'student', 'extracted_student_number', 'extracted_set_code', 'answers',
+    'confidence', 'marks', 'status', 'issues', 'phash', 'renditions', 'reviewed_at',
+]
+
+
+def _per_scan_ms(started: float, count: int) -> float:
+    """Wall time since ``started`` spread evenly over ``count`` scans."""
+    return round((time.perf_counter() - started) * 1000 / max(count, 1), 3)
+
+
+def file_digest(stream: IO[bytes]) -> str:
+    """SHA-256 of a file-like object, which is left rewound."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(1 << 20), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def enqueue_scans(scans: Iterable[Scan]) -> List[ScanJob]:
+    return ScanJob.objects.bulk_create([ScanJob(scan=scan) for scan in scans])
+
+
+def create_scan_batch(exam: Exam, uploads: Iterable[UploadedFile]) -> ScanBatch:
+    """Split ``uploads`` into page images and queue one scan per page.
+
+    Uploads are expected on disk (``TemporaryUploadedFile``); pages are
+    written to storage one at a time and all rows are inserted with a single
+    ``bulk_create``.
+    """
+    uploads = list(uploads)
+    batch = ScanBatch.objects.create(exam=exam, source_name=', '.join(u.name for u in uploads)[:255])
+    stored: List[str] = []
+    digests: List[str] = []
+    try:
+        for upload in uploads:
+            for filename, stream in iter_pages(Path(upload.temporary_file_path()), upload.name):
+                if len(stored) >= settings.SCAN_BATCH_MAX_PAGES:
+                    raise UnsupportedUpload(f'Batch exceeds {settings.SCAN_BATCH_MAX_PAGES} pages')
+                digests.append(file_digest(stream))
+                name = scan_upload_path(Scan(exam=exam), filename)
+                stored.append(default_storage.save(name, File(stream, name=filename)))
+        with transaction.atomic():
+            scans = Scan.objects.bulk_create([
+                Scan(exam=exam, batch=batch, image=name, content_digest=digest)
+                for name, digest in zip(stored, digests)
+            ])
+            enqueue_scans(scans)
+            batch.total = len(scans)
+            batch.save(update_fields=['total'])
+    except Exception:
+        for name in stored:
+            default_storage.delete(name)
+        batch.delete()
+        raise
+    return batch
+
+
+def batch_progress(batch: ScanBatch) -> dict:
+    counts = dict(batch.scans.values_list('status').annotate(n=Count('id')).order_by())
+    progress = {status: counts.get(status, 0) for status, _ in Scan.STATUS_CHOICES}
+    progress['done'] = progress[Scan.STATUS_PENDING] == 0
+    return progress
+
+
+def read_scans(scans: Sequence[Scan], executor: Executor | None = None) -> Iterator[Outcome]:
+    """Run the OMR reader over ``scans``, fanning out to ``executor`` if given.
+
+    Workers only receive image paths, layout keys and exam lengths and send
+    back compact ``OMRResult`` payloads; outcomes are yielded in input order.
+    """
+    paths = [scan.image.path for scan in scans]
+    layouts = [scan.exam.sheet_layout for scan in scans]
+    lengths = [scan.exam.num_items for scan in scans]
+    if executor is None:
+        return map(try_process_scan, paths, layouts, lengths)
+    return executor.map(try_process_scan, paths, layouts, lengths, chunksize=8)
+
+
+def split_repeats(scans: Sequence[Scan]) -> Tuple[List[Scan], List[Tuple[Scan, Scan]]]:
+    """Separate scans whose exact file was already uploaded for the exam.
+
+    Returns the scans that need reading and ``(scan, original)`` pairs for
+    repeats. The original is the earliest scan with the same content digest,
+    either one read before or one read in this batch, found with one query.
+    """
+    originals: Dict[Tuple[int, str], Scan] = {}
+    keyed = [scan for scan in scans if scan.content_digest]
+    if keyed:
+        earlier = (
+            Scan.objects.filter(
+                exam_id__in={scan.exam_id for scan in keyed},
+                content_digest__in={scan.content_digest for scan in keyed},
+            )
+            .exclude(status=Scan.STATUS_PENDING)
+            .exclude(pk__in=[scan.pk for scan in scans])
+            .order_by('pk')
+        )
+        for original in earlier:
+            originals.setdefault((original.exam_id, original.content_digest), original)
+
+    fresh: List[Scan] = []
+    repeats: List[Tuple[Scan, Scan]] = []
+    for scan in scans:
+        original = originals.get((scan.exam_id, scan.content_digest)) if scan.content_digest else None
+        if original is None:
+            fresh.append(scan)
+            if scan.content_digest:
+                originals[scan.exam_id, scan.content_digest] = scan
+        else:
+            repeats.append((scan, original))
+    return fresh, repeats
+
+
+def apply_repeats(repeats: Sequence[Tuple[Scan, Scan]], timings: Timings | None = None) -> None:
+    """Give repeat uploads their original's result without reading or scoring them again."""
+    if not repeats:
+        return
+    now = timezone.now()
+    for scan, original in repeats:
+        for name in REPEAT_FIELDS:
+            setattr(scan, name, getattr(original, name))
+        scan.duplicate_of = original
+        scan.updated_at = now
+        scan.timings = dict((timings or {}).get(scan.pk, {}))
+    Scan.objects.bulk_update([scan for scan, _ in repeats], Scan.PROCESSED_FIELDS + ['renditions'])
+
+
+def _hamming(hashes: np.ndarray, value: int) -> np.ndarray:
+    differing = np.bitwise_xor(hashes, np.int64(value)).view(np.uint8).reshape(-1, 8)
+    return np.unpackbits(differing, axis=1).sum(axis=1)
+
+
+def near_duplicates(pairs: Sequence[Tuple[Scan, Outcome]]) -> Dict[int, int]:
+    """Map scans of this batch to an earlier scan of the same sheet.
+
+    The same sheet means the same exam and decoded student number (the only
+    case where a second scan could replace a score) and a perceptual hash
+    within ``settings.SCAN_DUPLICATE_DISTANCE`` bits; mostly blank sheets of
+    different students can hash that close. Earlier means a lower id, so
+    re-reading an exam never flags an original against its own re-scan, and
+    scans already marked as duplicates never serve as the original.
+
+    The hash is taken by the reader rather than at upload: it is computed on
+    the registered bubble grids (a raw file hash changes with every rescan)
+    and is only compared alongside the decoded student number.
+    """
+    hashed = [
+        (scan, result.student_number, result.phash)
+        for scan, (result, _) in pairs
+        if result and result.student_number and result.phash is not None
+    ]
+    if not hashed:
+        return {}
+    known: Dict[Tuple[int, str], List[Tuple[int, int]]] = defaultdict(list)
+    rows = (
+        Scan.objects.filter(
+            exam_id__in={scan.exam_id for scan, _, _ in hashed},
+            extracted_student_number__in={number for _, number, _ in hashed},
+            phash__isnull=False,
+            duplicate_of__isnull=True,
+        )
+        .exclude(pk__in=[scan.pk for scan, _, _ in hashed])
+        .values_list('exam_id', 'extracted_student_number', 'pk', 'phash')
+    )
+    for exam_id, number, pk, phash in rows:
+        known[exam_id, number].append((pk, phash))
+    for scan, number, phash in hashed:
+        if not scan.duplicate_of_id:
+            known[scan.exam_id, number].append((scan.pk, phash))
+
+    matches: Dict[int, int] = {}
+    tables = {key: np.asarray(entries, dtype=np.int64) for key, entries in known.items()}
+    for scan, number, phash in hashed:
+        table = tables.get((scan.exam_id, number))
+        if table is None:
+            continue
+        earlier = table[table[:, 0] < scan.pk]
+        if not len(earlier):
+            continue
+        distances = _hamming(earlier[:, 1], phash)
+        best = int(distances.argmin())
+        if distances[best] <= settings.SCAN_DUPLICATE_DISTANCE:
+            matches[scan.pk] = int(earlier[best, 0])
+    return matches
+
+
+def apply_results(pairs: Sequence[Tuple[Scan, Outcome]], timings: Timings | None = None) -> None:
+    """Match students, upsert scores and update scans for a batch of outcomes.
+
+    Runs a constant number of queries per exam in the batch: one student
+    lookup per cohort, one score upsert per exam and one scan bulk update.
+    Each scan's ``timings`` combine the reader's stages, any ``timings``
+    given by the caller and the batch-level stages here, amortised per scan.
+    """
+    started = time.perf_counter()
+    wanted: Dict[int, set] = defaultdict(set)
+    for scan, (result, _) in pairs:
+        if result and result.student_number:
+            wanted[scan.exam.batch_id].add(result.student_number)
+    students: Dict[Tuple[int, str], Student] = {}
+    for batch_id, numbers in wanted.items():
+        for student in Student.objects.filter(batch_id=batch_id, student_number__in=numbers):
+            students[batch_id, student.student_number] = student
+    near = near_duplicates(pairs)
+    lookup_ms = _per_scan_ms(started, len(pairs))
+
+    entries: Dict[int, list] = defaultdict(list)
+    exams: Dict[int, Exam] = {}
+    now = timezone.now()
+    for scan, (result, error) in pairs:
+        scan.updated_at = now
+        scan.timings = {**(timings or {}).get(scan.pk, {}), **(result.timings if result else {}), 'student_lookup': lookup_ms}
+        if result is None:
+            scan.status = Scan.STATUS_NEEDS_REVIEW
+            scan.issues = ['processing_error', error]
+            continue
+        issues: List[str] = []
+        if result.confidence < settings.OMR_REVIEW_CONFIDENCE:
+            issues.append('low_confidence')
+        scan.phash = result.phash
+        scan.duplicate_of_id = near.get(scan.pk)
+        if scan.duplicate_of_id:
+            # Left for review rather than silently replacing the earlier scan's score.
+            issues.append('possible_duplicate')
+        student = students.get((scan.exam.batch_id, result.student_number)) if result.student_number else None
+        if result.student_number and not student:
+            issues.append('student_not_found')
+        # An unreadable set code is left for review rather than graded against a guessed key.
+        if student and not scan.duplicate_of_id and result.set_code:
+            exams[scan.exam_id] = scan.exam
+            entries[scan.exam_id].append((scan, student, result))
+        scan.mark_processed(
+            student=student,
+            extracted_student_number=result.student_number,
+            set_code=result.set_code,
+            answers=result.answers,
+            confidence=result.confidence,
+            issues=issues + result.issues,
+            marks=result.marks.as_json() if result.marks else None,
+            commit=False,
+        )
+
+    with transaction.atomic():
+        for exam_id, rows in entries.items():
+            started = time.perf_counter()
+            errors = upsert_scores(
+                exam=exams[exam_id],
+                entries=[(student, result.set_code, result.answers) for _, student, result in rows],
+            )
+            scoring_ms = _per_scan_ms(started, len(rows))
+            for scan, student, _ in rows:
+                scan.timings['scoring'] = scoring_ms
+                if student.pk in errors:
+                    scan.status = Scan.STATUS_NEEDS_REVIEW
+                    scan.issues = scan.issues + ['unknown_set_code']
+        Scan.objects.bulk_update([scan for scan, _ in pairs], Scan.PROCESSED_FIELDS)
+
+
+def render_scans(scans: Sequence[Scan], executor: Executor | None = None) -> None:
+    """Build review renditions for the scans without them, or whose last render failed."""
+    pending = [scan for scan in scans if not scan.renditions or 'error' in scan.renditions]
+    if not pending:
+        return
+    started = time.perf_counter()
+    prefixes = [f'renditions/{scan.exam_id}/{scan.pk}' for scan in pending]
+    paths = [scan.image.path for scan in pending]
+    out_dirs = [default_storage.path(prefix) for prefix in prefixes]
+    if executor is None:
+        manifests = map(try_build_renditions, paths, out_dirs)
+    else:
+        manifests = executor.map(try_build_renditions, paths, out_dirs, chunksize=8)
+    for scan, prefix, manifest in zip(pending, prefixes, manifests):
+        if manifest:
+            manifest['thumbnail'] = f"{prefix}/{manifest['thumbnail']}"
+            manifest['preview'] = f"{prefix}/{manifest['preview']}"
+            manifest['tiles']['path'] = f"{prefix}/{manifest['tiles']['path']}"
+        scan.renditions = manifest
+    renditions_ms = _per_scan_ms(started, len(pending))
+    for scan in pending:
+        scan.timings = {**scan.timings, 'renditions': renditions_ms}
+    Scan.objects.bulk_update(pending, ['renditions', 'timings'])
+
+
+def process_scan_record(scan: Scan) -> None:
+    """Read and grade ``scan`` in the current process, unless it repeats an earlier upload."""
+    fresh, repeats = split_repeats([scan])
+    if fresh:
+        apply_results([(scan, try_process_scan(scan.image.path, scan.exam.sheet_layout, scan.exam.num_items))])
+        render_scans([scan])
+    apply_repeats(repeats)
+
+
+def claim_jobs(limit: int) -> List[ScanJob]:
+    """Lock up to ``limit`` queued (or abandoned) jobs for this worker.
+
+    Abandoned jobs that already used up their attempts are failed instead,
+    so a sheet that keeps killing its worker is not retried forever.
+    """
+    now = timezone.now()
+    abandoned = Q(status=ScanJob.STATUS_RUNNING, locked_at__lt=now - STALE_AFTER)
+    with transaction.atomic():
+        exhausted = ScanJob.objects.select_for_update(skip_locked=True).filter(abandoned, attempts__gte=MAX_ATTEMPTS)
+        for job in exhausted:
+            _fail_job(job, 'worker stopped before finishing the scan')
+        jobs = list(
+            ScanJob.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('scan__exam')
+            .filter(Q(status=ScanJob.STATUS_QUEUED) | (abandoned & Q(attempts__lt=MAX_ATTEMPTS)))
+            .order_by('id')[:limit]
+        )
+        ScanJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=ScanJob.STATUS_RUNNING,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+        )
+    for job in jobs:
+        job.attempts += 1
+    return jobs
+
+
+def run_jobs(limit: int, executor: Executor | None = None) -> int:
+    """Claim a batch of jobs, read the sheets and store the results.
+
+    With an ``executor`` the OpenCV work fans out to its workers while all
+    database writes stay in the calling process. Returns the number of jobs
+    claimed.
+    """
+    jobs = claim_jobs(limit)
+    if not jobs:
+        return 0
+    scans = [job.scan for job in jobs]
+    claimed = timezone.now()
+    waits = {job.scan_id: {'queue_wait': round((claimed - job.created_at).total_seconds() * 1000, 3)} for job in jobs}
+    errors: Dict[int, str] = {}
+    try:
+        _process_batch(scans, executor, waits)
+    except Exception:  # noqa: BLE001 - retried one scan at a time below
+        # One bad sheet must not requeue (or fail) the rest of the batch.
+        for job in jobs:
+            try:
+                _process_batch([job.scan], executor, waits)
+            except Exception as exc:  # noqa: BLE001 - recorded on the job
+                errors[job.pk] = str(exc)
+    for job in jobs:
+        if job.pk in errors:
+            _fail_job(job, errors[job.pk])
+    ScanJob.objects.filter(pk__in=[job.pk for job in jobs if job.pk not in errors]).update(
+        status=ScanJob.STATUS_DONE, last_error='', finished_at=timezone.now(),
+    )
+    return len(jobs)
+
+
+def _process_batch(scans: Sequence[Scan], executor: Executor | None, timings: Timings) -> None:
+    fresh, repeats = split_repeats(scans)
+    apply_results(list(zip(fresh, read_scans(fresh, executor))), timings=timings)
+    render_or_record(fresh, executor)
+    apply_repeats(repeats, timings=timings)
+    # Originals from before renditions existed still need their own.
+    render_or_record([scan for scan, _ in repeats], executor)
+
+
+def render_or_record(scans: Sequence[Scan], executor: Executor | None) -> None:
+    """Render ``scans``, recording a failure on them rather than failing their committed jobs."""
+    pending = [scan for scan in scans if not scan.renditions or 'error' in scan.renditions]
+    try:
+        render_scans(pending, executor)
+    except Exception as exc:  # noqa: BLE001 - the next render retries these scans
+        failure = {'error': str(exc) or exc.__class__.__name__}
+        for scan in pending:
+            scan.renditions = failure
+        Scan.objects.filter(pk__in=[scan.pk for scan in pending]).update(renditions=failure)
+
+
+def _fail_job(job: ScanJob, error: str) -> None:
+    """Requeue ``job`` after a failed attempt, or give up on it once attempts run out."""
+    if job.attempts < MAX_ATTEMPTS:
+        ScanJob.objects.filter(pk=job.pk).update(status=ScanJob.STATUS_QUEUED, last_error=error)
+        return
+    ScanJob.objects.filter(pk=job.pk).update(
+        status=ScanJob.STATUS_FAILED, last_error=error, finished_at=timezone.now(),
+    )
+    Scan.objects.filter(pk=job.scan_id).update(
+        status=Scan.STATUS_NEEDS_REVIEW, issues=['processing_error', error], updated_at=timezone.now(),
+    )
@@ -0,0 +1,23 @@
+import shutil
+from pathlib import PurePosixPath
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Scan
+
+
+@receiver(post_delete, sender=Scan)
+def scan_deleted(sender, instance, **kwargs):
+    thumbnail = instance.renditions.get('thumbnail')
+    if not thumbnail:
+        return
+
+    def remove_renditions():
+        # Repeat uploads share their original's renditions; the last one out removes them.
+        if not Scan.objects.filter(renditions__thumbnail=thumbnail).exists():
+            shutil.rmtree(default_storage.path(str(PurePosixPath(thumbnail).parent)), ignore_errors=True)
+
+    transaction.on_commit(remove_renditions)
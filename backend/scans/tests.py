@@ -1,46 +1,463 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
 from pathlib import Path
+from unittest import mock
 
 import cv2
-import numpy as np
+from PIL import Image
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APIClient
 
 from accounts.models import User
 from core.models import Batch, Student
 from exams.models import Exam, ExamSet, Score
-from .models import Scan
+from exams.services import upsert_score
+from omr.overlay import cached_overlay, evict_overlays
+from omr.synthetic import degrade_sheet, render_sheet
+from .models import Scan, ScanBatch, ScanJob
 from .serializers import ScanSerializer
-from .views import ScanViewSet
+from . import services
+from .services import enqueue_scans, process_scan_record, run_jobs
 
 
-class ScanProcessingTests(TestCase):
+class TempMediaMixin:
+    """Keep the uploads and renditions a test writes out of the real MEDIA_ROOT."""
+
     def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+class ScanProcessingTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
         self.batch = Batch.objects.create(name='Batch 1', code='B1')
         self.student = Student.objects.create(batch=self.batch, student_number='001', full_name='Alice')
         self.exam = Exam.objects.create(batch=self.batch, title='Quiz', num_items=3)
         ExamSet.objects.create(exam=self.exam, set_code='A', answer_key=['A', 'B', 'C'])
         self.user = User.objects.create_user(username='checker', password='pass', role=User.ROLE_CHECKER)
 
-    def _create_test_image(self):
-        tmp_dir = Path('media/tests')
-        tmp_dir.mkdir(parents=True, exist_ok=True)
-        path = tmp_dir / 'scan__student-001__set-A.png'
-        cv2.imwrite(str(path), np.zeros((50, 50, 3), dtype=np.uint8))
-        path.with_suffix('.json').write_text('{"answers": ["A", "B", "C"]}', encoding='utf-8')
-        with path.open('rb') as fh:
-            return SimpleUploadedFile(path.name, fh.read(), content_type='image/png')
+    def _create_test_image(self, student_number='001', answers=('A', 'B', 'C'), set_code='A', **options):
+        ok, encoded = cv2.imencode('.png', render_sheet(answers, student_number=student_number, set_code=set_code, **options))
+        return SimpleUploadedFile('IMG_0001.png', encoded.tobytes(), content_type='image/png')
 
     def test_scan_processing_creates_score(self):
         data = {'exam': self.exam.id, 'image': self._create_test_image()}
         serializer = ScanSerializer(data=data)
         self.assertTrue(serializer.is_valid(), serializer.errors)
-        viewset = ScanViewSet()
-        viewset.request = type('obj', (), {'user': self.user})
         scan = serializer.save()
-        viewset._process_scan(scan)
+        process_scan_record(scan)
         self.assertEqual(Scan.objects.count(), 1)
         self.assertEqual(Score.objects.count(), 1)
         score = Score.objects.first()
         self.assertEqual(score.raw_score, 3)
         scan.refresh_from_db()
         self.assertEqual(scan.extracted_student_number, '001')
+        self.assertEqual(scan.status, Scan.STATUS_PROCESSED)
+        self.assertEqual(scan.marks['status'][:3], ['single'] * 3)
+
+    def test_faint_mark_sends_scan_to_review(self):
+        image = self._create_test_image(answers=['A', '', 'C'], erased={1: 'D'})
+        serializer = ScanSerializer(data={'exam': self.exam.id, 'image': image})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        scan = serializer.save()
+        process_scan_record(scan)
+        scan.refresh_from_db()
+        self.assertEqual(scan.status, Scan.STATUS_NEEDS_REVIEW)
+        self.assertIn('low_confidence', scan.issues)
+        self.assertEqual(scan.marks['status'][1], 'faint')
+
+    def test_marks_past_the_exam_are_ignored(self):
+        image = self._create_test_image(answers=['A', 'B', 'C', '', '', '', 'AB'], erased={5: 'D'})
+        serializer = ScanSerializer(data={'exam': self.exam.id, 'image': image})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        scan = serializer.save()
+        process_scan_record(scan)
+        scan.refresh_from_db()
+        self.assertEqual(scan.marks['status'][5:7], ['faint', 'multiple'])
+        self.assertEqual((scan.status, scan.issues), (Scan.STATUS_PROCESSED, []))
+
+    def test_unreadable_set_code_is_not_scored(self):
+        serializer = ScanSerializer(data={'exam': self.exam.id, 'image': self._create_test_image(set_code='')})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        scan = serializer.save()
+        process_scan_record(scan)
+        scan.refresh_from_db()
+        self.assertEqual((scan.status, scan.issues), (Scan.STATUS_NEEDS_REVIEW, ['missing_set_code']))
+        self.assertEqual(scan.extracted_set_code, '')
+        self.assertFalse(Score.objects.exists())
+
+    def _upload(self, image):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/scans/', {'exam': self.exam.id, 'image': image}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Scan.objects.get(pk=response.data['id'])
+
+    def test_repeat_upload_reuses_result(self):
+        first = self._upload(self._create_test_image())
+        again = self._upload(self._create_test_image())
+        self.assertEqual(first.content_digest, again.content_digest)
+        with mock.patch.object(services, 'try_process_scan', wraps=services.try_process_scan) as read:
+            run_jobs(10)
+            late = self._upload(self._create_test_image())
+            run_jobs(10)
+        self.assertEqual(read.call_count, 1)
+        for scan in (again, late):
+            scan.refresh_from_db()
+            self.assertEqual(scan.duplicate_of_id, first.pk)
+            self.assertEqual(scan.status, Scan.STATUS_PROCESSED)
+            self.assertEqual(scan.answers[:3], ['A', 'B', 'C'])
+            self.assertEqual(scan.renditions, Scan.objects.get(pk=first.pk).renditions)
+        self.assertEqual(Score.objects.get().raw_score, 3)
+        # Re-reading the exam resolves the repeats the same way.
+        out = io.StringIO()
+        call_command('process_scans', exam=self.exam.id, workers=1, stdout=out)
+        self.assertIn('1/1 scans written', out.getvalue())
+        for scan in (again, late):
+            scan.refresh_from_db()
+            self.assertEqual(scan.duplicate_of_id, first.pk)
+            self.assertEqual((scan.status, scan.issues), (Scan.STATUS_PROCESSED, []))
+
+    def _degraded_upload(self, answers, seed):
+        sheet = degrade_sheet(render_sheet(answers, student_number='001', set_code='A', scale=1.5), noise=6, margin=20, seed=seed)
+        ok, encoded = cv2.imencode('.png', sheet)
+        return self._upload(SimpleUploadedFile(f'IMG_{seed:04d}.png', encoded.tobytes(), content_type='image/png'))
+
+    def test_rescan_is_flagged_without_rescoring(self):
+        first = self._degraded_upload(['A', 'B', 'C'], seed=1)
+        run_jobs(10)
+        rescan = self._degraded_upload(['A', 'B', 'D'], seed=2)
+        run_jobs(10)
+        rescan.refresh_from_db()
+        self.assertEqual(rescan.status, Scan.STATUS_NEEDS_REVIEW)
+        self.assertIn('possible_duplicate', rescan.issues)
+        self.assertEqual(rescan.duplicate_of_id, first.pk)
+        self.assertEqual(Score.objects.get().raw_score, 3)
+        # Re-reading the exam never flags the original against its re-scan.
+        call_command('process_scans', exam=self.exam.id, workers=1, stdout=io.StringIO())
+        first.refresh_from_db()
+        self.assertEqual(first.status, Scan.STATUS_PROCESSED)
+        self.assertIsNone(first.duplicate_of_id)
+
+    def test_queued_scan_is_processed_by_worker(self):
+        serializer = ScanSerializer(data={'exam': self.exam.id, 'image': self._create_test_image()})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        scan = serializer.save()
+        enqueue_scans([scan])
+        self.assertEqual(scan.status, Scan.STATUS_PENDING)
+        self.assertEqual(run_jobs(10), 1)
+        self.assertEqual(run_jobs(10), 0)
+        scan.refresh_from_db()
+        self.assertEqual(scan.status, Scan.STATUS_PROCESSED)
+        self.assertEqual(ScanJob.objects.get().status, ScanJob.STATUS_DONE)
+        self.assertEqual(Score.objects.get().raw_score, 3)
+        self.assertLessEqual(
+            {'queue_wait', 'decode', 'register', 'sample', 'interpret', 'student_lookup', 'scoring', 'renditions'},
+            set(scan.timings),
+        )
+
+    def test_bad_scan_does_not_fail_its_batch(self):
+        scans = []
+        for number in ('001', '002'):
+            Student.objects.get_or_create(batch=self.batch, student_number=number, defaults={'full_name': number})
+            serializer = ScanSerializer(data={'exam': self.exam.id, 'image': self._create_test_image(number)})
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            scans.append(serializer.save())
+        enqueue_scans(scans)
+        apply_results = services.apply_results
+
+        def flaky(pairs, **kwargs):
+            if any(scan.pk == scans[0].pk for scan, _ in pairs):
+                raise RuntimeError('bad sheet')
+            return apply_results(pairs, **kwargs)
+
+        with mock.patch.object(services, 'apply_results', side_effect=flaky):
+            self.assertEqual(run_jobs(10), 2)
+        bad, good = (ScanJob.objects.get(scan=scan) for scan in scans)
+        self.assertEqual((bad.status, bad.last_error), (ScanJob.STATUS_QUEUED, 'bad sheet'))
+        self.assertEqual(good.status, ScanJob.STATUS_DONE)
+        self.assertEqual(Score.objects.get().student.student_number, '002')
+
+    def test_abandoned_job_out_of_attempts_is_failed(self):
+        serializer = ScanSerializer(data={'exam': self.exam.id, 'image': self._create_test_image()})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        scan = serializer.save()
+        ScanJob.objects.create(
+            scan=scan, status=ScanJob.STATUS_RUNNING, attempts=services.MAX_ATTEMPTS,
+            locked_at=timezone.now() - 2 * services.STALE_AFTER,
+        )
+        self.assertEqual(run_jobs(10), 0)
+        scan.refresh_from_db()
+        self.assertEqual(ScanJob.objects.get().status, ScanJob.STATUS_FAILED)
+        self.assertEqual(scan.status, Scan.STATUS_NEEDS_REVIEW)
+        self.assertEqual(scan.issues[0], 'processing_error')
+
+    def test_stage_timings_are_exported(self):
+        serializer = ScanSerializer(data={'exam': self.exam.id, 'image': self._create_test_image()})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        process_scan_record(serializer.save())
+        client = APIClient()
+        client.force_authenticate(self.user)
+        stages = client.get('/api/scans/timings/', {'exam': self.exam.id}).data['stages']
+        self.assertEqual(stages['decode']['count'], 1)
+        self.assertGreaterEqual(stages['register']['p95_ms'], stages['register']['p50_ms'])
+
+        self.assertEqual(APIClient().get('/api/metrics').status_code, 401)
+        self.assertEqual(client.get('/api/metrics').status_code, 403)
+        admin = APIClient()
+        admin.force_authenticate(User.objects.create_user(username='admin', password='pass', role=User.ROLE_ADMIN))
+        self.assertEqual(admin.get('/api/metrics').status_code, 200)
+        with override_settings(METRICS_PUBLIC=True):
+            self.assertEqual(APIClient().get('/api/metrics').status_code, 200)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(APIClient().get('/api/metrics', HTTP_AUTHORIZATION='Bearer secreT').status_code, 401)
+            response = APIClient().get('/api/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        body = response.content.decode()
+        self.assertIn(f'omr_scan_stage_seconds{{exam="{self.exam.id}",stage="decode",quantile="0.95"}}', body)
+        self.assertIn(f'omr_scans{{exam="{self.exam.id}",status="processed"}} 1', body)
+
+    def test_pipeline_builds_review_renditions(self):
+        serializer = ScanSerializer(data={'exam': self.exam.id, 'image': self._create_test_image()})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        scan = serializer.save()
+        process_scan_record(scan)
+        scan.refresh_from_db()
+        data = ScanSerializer(scan).data
+        self.assertTrue(data['thumbnail'].endswith('/thumbnail.webp'))
+        self.assertEqual(data['tiles']['width'], 1400)
+        self.assertEqual(data['tiles']['levels'], 12)
+        with Image.open(default_storage.path(scan.renditions['thumbnail'])) as thumbnail:
+            self.assertEqual(max(thumbnail.size), 320)
+        top = default_storage.path(scan.renditions['tiles']['path'])
+        self.assertTrue(Path(top, '11', '2_1.webp').exists())
+        self.assertTrue(Path(top, '0', '0_0.webp').exists())
+
+    def test_render_failure_does_not_fail_the_job(self):
+        serializer = ScanSerializer(data={'exam': self.exam.id, 'image': self._create_test_image()})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        scan = serializer.save()
+        enqueue_scans([scan])
+        with mock.patch.object(services, 'render_scans', side_effect=OSError('disk full')):
+            run_jobs(10)
+        scan.refresh_from_db()
+        self.assertEqual(ScanJob.objects.get().status, ScanJob.STATUS_DONE)
+        self.assertEqual((scan.status, scan.renditions), (Scan.STATUS_PROCESSED, {'error': 'disk full'}))
+        self.assertEqual(Score.objects.get().raw_score, 3)
+        # The next render retries it.
+        services.render_scans([scan])
+        self.assertIn('thumbnail', Scan.objects.get(pk=scan.pk).renditions)
+
+    def test_deleting_a_scan_removes_its_renditions(self):
+        serializer = ScanSerializer(data={'exam': self.exam.id, 'image': self._create_test_image()})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        scan = serializer.save()
+        process_scan_record(scan)
+        scan.refresh_from_db()
+        folder = Path(default_storage.path(scan.renditions['thumbnail'])).parent
+        self.assertTrue(folder.is_dir())
+        with self.captureOnCommitCallbacks(execute=True):
+            scan.delete()
+        self.assertFalse(folder.exists())
+
+    def test_process_scans_command_rereads_exam(self):
+        scans = []
+        for number in ('001', '002', '003'):
+            Student.objects.get_or_create(batch=self.batch, student_number=number, defaults={'full_name': number})
+            serializer = ScanSerializer(data={'exam': self.exam.id, 'image': self._create_test_image(number)})
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            scans.append(serializer.save())
+        call_command('process_scans', exam=self.exam.id, workers=2, chunk_size=2, stdout=io.StringIO())
+        self.assertEqual(Scan.objects.filter(status=Scan.STATUS_PROCESSED).count(), 3)
+        self.assertEqual(set(Score.objects.values_list('raw_score', flat=True)), {3})
+
+        # A reviewer's correction survives a re-read unless it is asked for.
+        student = Student.objects.get(student_number='001')
+        upsert_score(exam=self.exam, student=student, set_code='A', answers=['A', 'B', 'D'])
+        scans[0].mark_processed(
+            student=student, extracted_student_number='001', set_code='A', answers=['A', 'B', 'D'],
+            confidence=1.0, reviewed_at=timezone.now(),
+        )
+        call_command('process_scans', exam=self.exam.id, workers=1, stdout=io.StringIO())
+        self.assertEqual(Score.objects.get(student=student).raw_score, 2)
+        call_command('process_scans', exam=self.exam.id, workers=1, include_reviewed=True, stdout=io.StringIO())
+        self.assertEqual(Score.objects.get(student=student).raw_score, 3)
+        self.assertIsNone(Scan.objects.get(pk=scans[0].pk).reviewed_at)
+
+    def test_process_scans_command_survives_render_failure(self):
+        serializer = ScanSerializer(data={'exam': self.exam.id, 'image': self._create_test_image()})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        scan = serializer.save()
+        with mock.patch.object(services, 'render_scans', side_effect=OSError('disk full')):
+            call_command('process_scans', exam=self.exam.id, workers=1, stdout=io.StringIO())
+        scan.refresh_from_db()
+        self.assertEqual((scan.status, scan.renditions), (Scan.STATUS_PROCESSED, {'error': 'disk full'}))
+        self.assertEqual(Score.objects.get().raw_score, 3)
+
+
+class ScanBatchUploadTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        batch = Batch.objects.create(name='Batch 1', code='B1')
+        self.exam = Exam.objects.create(batch=batch, title='Quiz', num_items=3)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='checker', password='pass', role=User.ROLE_CHECKER))
+
+    def _png(self, answers):
+        ok, encoded = cv2.imencode('.png', render_sheet(answers))
+        return encoded.tobytes()
+
+    def test_zip_with_images_and_multipage_tiff(self):
+        tiff = io.BytesIO()
+        pages = [Image.fromarray(render_sheet(['A'])), Image.fromarray(render_sheet(['B']))]
+        pages[0].save(tiff, format='TIFF', save_all=True, append_images=pages[1:])
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('IMG_0001.png', self._png(['A']))
+            zf.writestr('scans/IMG_0002.jpg', self._png(['C']))
+            zf.writestr('stack.tif', tiff.getvalue())
+            zf.writestr('notes.txt', 'ignored')
+        upload = SimpleUploadedFile('room-1.zip', archive.getvalue(), content_type='application/zip')
+
+        response = self.client.post('/api/scans/batch_upload/', {'exam': self.exam.id, 'files': [upload]}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['total'], 4)
+        self.assertEqual(response.data['progress']['pending'], 4)
+        batch = ScanBatch.objects.get()
+        self.assertEqual(batch.scans.count(), 4)
+        self.assertEqual(ScanJob.objects.filter(scan__batch=batch).count(), 4)
+
+        run_jobs(10)
+        progress = self.client.get(f'/api/scan-batches/{batch.id}/').data['progress']
+        self.assertTrue(progress['done'])
+        self.assertEqual(progress['pending'], 0)
+
+    def test_rejects_unsupported_file(self):
+        upload = SimpleUploadedFile('notes.txt', b'hello', content_type='text/plain')
+        response = self.client.post('/api/scans/batch_upload/', {'exam': self.exam.id, 'files': [upload]}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ScanBatch.objects.exists())
+
+
+class ScanOverlayTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        batch = Batch.objects.create(name='Batch 1', code='B1')
+        exam = Exam.objects.create(batch=batch, title='Quiz', num_items=3)
+        ok, encoded = cv2.imencode('.png', render_sheet(['A', 'B', 'C']))
+        self.scan = Scan.objects.create(exam=exam, image=SimpleUploadedFile('sheet.png', encoded.tobytes()), answers=['A', 'B', 'C'])
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='checker', password='pass', role=User.ROLE_CHECKER))
+
+    def test_overlay_is_cached_and_revalidated(self):
+        with override_settings(OVERLAY_CACHE_DIR=str(self.cache_dir)):
+            response = self.client.get(f'/api/scans/{self.scan.id}/overlay/')
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            self.assertEqual(len(list(self.cache_dir.glob('*/*.png'))), 1)
+
+            response = self.client.get(f'/api/scans/{self.scan.id}/overlay/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+            self.scan.answers = ['A', 'B', 'D']
+            self.scan.save()
+            response = self.client.get(f'/api/scans/{self.scan.id}/overlay/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+            last_modified = response['Last-Modified']
+            response = self.client.get(f'/api/scans/{self.scan.id}/overlay/', HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304)
+            # A stale ETag wins over a current date.
+            response = self.client.get(f'/api/scans/{self.scan.id}/overlay/', HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+            self.assertEqual(response.status_code, 200)
+            with mock.patch('scans.views.OVERLAY_UPDATED', timezone.now() + timedelta(minutes=5)):
+                response = self.client.get(f'/api/scans/{self.scan.id}/overlay/', HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 200)
+
+    def test_overlay_survives_concurrent_eviction(self):
+        with override_settings(OVERLAY_CACHE_DIR=str(self.cache_dir)):
+            with cached_overlay('ab' * 16, self.scan.image.path, ['A']) as first:
+                evict_overlays(0, self.cache_dir)
+                self.assertTrue(first.read().startswith(b'\x89PNG'))
+            with cached_overlay('ab' * 16, self.scan.image.path, ['A']) as again:
+                self.assertTrue(again.read().startswith(b'\x89PNG'))
+
+    def test_unknown_layout_is_a_client_error(self):
+        exam = self.scan.exam
+        exam.sheet_layout = 'missing'
+        with self.assertRaises(ValidationError):
+            exam.full_clean()
+        exam.save()
+        response = self.client.get(f'/api/scans/{self.scan.id}/overlay/')
+        self.assertEqual(response.status_code, 400)
+        process_scan_record(Scan.objects.get(pk=self.scan.pk))
+        self.scan.refresh_from_db()
+        self.assertEqual(self.scan.issues, ['processing_error', 'Unknown sheet layout missing'])
+
+    def test_eviction_keeps_cache_under_budget(self):
+        for index, age in enumerate([300, 200, 100]):
+            path = self.cache_dir / 'ab' / f'ab{index}.png'
+            path.parent.mkdir(exist_ok=True)
+            path.write_bytes(b'x' * 100)
+            os.utime(path, (time.time() - age, time.time() - age))
+        self.assertEqual(evict_overlays(150, self.cache_dir), 2)
+        self.assertEqual([p.name for p in self.cache_dir.glob('*/*.png')], ['ab2.png'])
+
+
+class ScanListTests(TestCase):
+    def setUp(self):
+        batch = Batch.objects.create(name='Batch 1', code='B1')
+        self.exam = Exam.objects.create(batch=batch, title='Quiz', num_items=3)
+        ExamSet.objects.create(exam=self.exam, set_code='A', answer_key=['A', 'B', 'C'])
+        student = Student.objects.create(batch=batch, student_number='001', full_name='Alice')
+        Scan.objects.bulk_create([
+            Scan(exam=self.exam, student=student, image=f'scans/{index}.png', answers=['A', 'B', 'C'], status=status)
+            for index, status in enumerate([Scan.STATUS_PROCESSED, Scan.STATUS_NEEDS_REVIEW] * 3)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='checker', password='pass', role=User.ROLE_CHECKER))
+
+    def test_list_is_lean_and_cursor_paginated(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/scans/', {'exam': self.exam.id, 'page_size': 4})
+        self.assertEqual(len(response.data['results']), 4)
+        first = response.data['results'][0]
+        self.assertNotIn('answers', first)
+        self.assertNotIn('exam_detail', first)
+        self.assertEqual(first['student_detail']['batch_name'], 'Batch 1')
+
+        rest = self.client.get(response.data['next'])
+        ids = [scan['id'] for scan in response.data['results'] + rest.data['results']]
+        self.assertEqual(ids, sorted(Scan.objects.values_list('id', flat=True), reverse=True))
+
+    def test_sparse_fields_and_status_filter(self):
+        response = self.client.get('/api/scans/', {'status': 'needs_review,pending', 'fields': 'id,answers,exam_detail'})
+        results = response.data['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual(set(results[0]), {'id', 'answers', 'exam_detail'})
+        self.assertEqual(results[0]['exam_detail']['sets'][0]['answer_key'], ['A', 'B', 'C'])
+
+    def test_explain_scan_queries_rolls_back(self):
+        out = io.StringIO()
+        call_command('explain_scan_queries', scans=200, exams=2, stdout=out)
+        self.assertIn('== without indexes ==', out.getvalue())
+        self.assertEqual(Scan.objects.count(), 6)
+        self.assertEqual(Batch.objects.count(), 1)
@@ -1,6 +1,7 @@
 from rest_framework import routers
 
-from .views import ScanViewSet
+from .views import ScanBatchViewSet, ScanViewSet
 
 router = routers.DefaultRouter()
 router.register(r'scans', ScanViewSet)
+router.register(r'scan-batches', ScanBatchViewSet)
@@ -1,24 +1,39 @@
 from __future__ import annotations
 
-from django.http import FileResponse
-from rest_framework import status, viewsets
+import hmac
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import mixins, status, viewsets
 from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.permissions import BasePermission
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from accounts.permissions import IsAdmin, IsAdminOrChecker
+from core.api import IdCursorPagination, requested_fields
 from core.models import Student
 from exams.services import upsert_score
-from .models import Scan
-from .serializers import ScanSerializer
-from omr.overlay import build_overlay
-from omr.reader import OMRProcessingError, process_scan
+from .ingest import UnsupportedUpload
+from .metrics import prometheus_text, stage_samples, stage_summary
+from .models import Scan, ScanBatch
+from .serializers import ScanBatchSerializer, ScanBatchUploadSerializer, ScanSerializer
+from .services import create_scan_batch, enqueue_scans, file_digest
+from omr.layout import LayoutError, layout_for_exam
+from omr.overlay import OVERLAY_UPDATED, cached_overlay, overlay_key
 
 
 class ScanViewSet(viewsets.ModelViewSet):
-    queryset = Scan.objects.select_related('exam', 'student').all()
+    queryset = Scan.objects.select_related('exam', 'student__batch').all()
     serializer_class = ScanSerializer
     parser_classes = [MultiPartParser, FormParser]
+    pagination_class = IdCursorPagination
 
     def get_permissions(self):
         if self.action in ['destroy']:
@@ -34,37 +49,43 @@ class ScanViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(exam_id=exam_id)
         status_filter = self.request.query_params.get('status')
         if status_filter:
-            queryset = queryset.filter(status=status_filter)
+            queryset = queryset.filter(status__in=status_filter.split(','))
+        if self.action == 'list':
+            fields = requested_fields(self.request) or set()
+            heavy = {'answers', 'marks'} - fields
+            if heavy:
+                queryset = queryset.defer(*heavy)
+            if 'exam_detail' in fields:
+                queryset = queryset.prefetch_related('exam__sets')
         return queryset
 
     def perform_create(self, serializer):
-        scan: Scan = serializer.save()
-        self._process_scan(scan)
+        scan: Scan = serializer.save(content_digest=file_digest(serializer.validated_data['image']))
+        enqueue_scans([scan])
 
-    def _process_scan(self, scan: Scan) -> None:
+    @action(detail=False, methods=['post'])
+    def batch_upload(self, request):
+        # Stream every upload straight to a temporary file instead of memory.
+        request._request.upload_handlers = [TemporaryFileUploadHandler(request._request)]
+        serializer = ScanBatchUploadSerializer(data={
+            'exam': request.data.get('exam'),
+            'files': request.FILES.getlist('files') or request.FILES.getlist('file'),
+        })
+        serializer.is_valid(raise_exception=True)
         try:
-            result = process_scan(scan.image.path)
-        except OMRProcessingError as exc:  # pragma: no cover - defensive
-            scan.status = Scan.STATUS_NEEDS_REVIEW
-            scan.issues = ['processing_error', str(exc)]
-            scan.save(update_fields=['status', 'issues', 'updated_at'])
-            return
-
-        student = None
-        if result.student_number:
-            student = Student.objects.filter(batch=scan.exam.batch, student_number=result.student_number).first()
-            if not student:
-                scan.issues.append('student_not_found')
-        if student:
-            upsert_score(exam=scan.exam, student=student, set_code=result.set_code, answers=result.answers)
-        scan.mark_processed(
-            student=student,
-            extracted_student_number=result.student_number,
-            set_code=result.set_code,
-            answers=result.answers,
-            confidence=result.confidence,
-            issues=scan.issues + result.issues if scan.issues else result.issues,
-        )
+            batch = create_scan_batch(serializer.validated_data['exam'], serializer.validated_data['files'])
+        except (UnsupportedUpload, OSError, ValueError) as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(ScanBatchSerializer(batch).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def timings(self, request):
+        exam_id = request.query_params.get('exam', '')
+        if not exam_id.isdigit():
+            return Response({'detail': 'exam is required'}, status=status.HTTP_400_BAD_REQUEST)
+        exam_id = int(exam_id)
+        samples = stage_samples(exam_id).get(exam_id, {})
+        return Response({'exam': exam_id, 'window_seconds': settings.METRICS_WINDOW, 'stages': stage_summary(samples)})
 
     @action(detail=True, methods=['post'])
     def review(self, request, pk=None):
@@ -83,11 +104,69 @@ class ScanViewSet(viewsets.ModelViewSet):
             answers=answers,
             confidence=1.0,
             issues=[],
+            reviewed_at=timezone.now(),
         )
         return Response(ScanSerializer(scan, context=self.get_serializer_context()).data)
 
     @action(detail=True, methods=['get'])
     def overlay(self, request, pk=None):
         scan = self.get_object()
-        overlay_path = build_overlay(scan.image.path, scan.answers or [])
-        return FileResponse(open(overlay_path, 'rb'), content_type='image/png')
+        answers = scan.answers or []
+        try:
+            layout = layout_for_exam(scan.exam)
+        except LayoutError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        # Draw on the medium preview when the pipeline has produced one.
+        source = scan.renditions.get('preview') or scan.image.name
+        key = overlay_key(scan.pk, source, answers, layout.key, layout.version)
+        etag = f'"{key}"'
+        # The key covers everything the overlay depends on; the date is for
+        # clients that only send If-Modified-Since (If-None-Match wins when
+        # both are present).
+        last_modified = int(max(scan.updated_at, OVERLAY_UPDATED).timestamp())
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+        response = FileResponse(cached_overlay(key, default_storage.path(source), answers), content_type='image/png')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class ScanBatchViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    queryset = ScanBatch.objects.all()
+    serializer_class = ScanBatchSerializer
+    permission_classes = [IsAdminOrChecker]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        exam_id = self.request.query_params.get('exam')
+        if exam_id:
+            queryset = queryset.filter(exam_id=exam_id)
+        return queryset
+
+
+class CanReadMetrics(BasePermission):
+    """The scraper's ``METRICS_TOKEN``, an admin, or anyone once ``METRICS_PUBLIC`` is set."""
+
+    def has_permission(self, request, view):
+        token = settings.METRICS_TOKEN
+        if token and hmac.compare_digest(
+            request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode(),
+        ):
+            return True
+        return settings.METRICS_PUBLIC or IsAdmin().has_permission(request, view)
+
+
+class MetricsView(APIView):
+    """Prometheus text exposition of the pipeline metrics."""
+
+    permission_classes = [CanReadMetrics]
+
+    def perform_authentication(self, request):
+        # The scrape token is not a JWT; only authenticate when falling back to admins.
+        pass
+
+    def get(self, request):
+        return HttpResponse(prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
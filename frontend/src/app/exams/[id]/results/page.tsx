@@ -4,7 +4,7 @@ import { useParams } from 'next/navigation';
 import { useQuery } from '@tanstack/react-query';
 import { Button, Table } from 'react-bootstrap';
 import Layout from '../../../../components/Layout';
-import { api } from '../../../../lib/api';
+import { api, listAll } from '../../../../lib/api';
 
 interface Score {
   id: number;
@@ -23,10 +23,7 @@ export default function ResultsPage() {
 
   const query = useQuery({
     queryKey: ['scores', examId],
-    queryFn: async () => {
-      const res = await api.get('/scores/', { params: { exam: examId } });
-      return res.data as Score[];
-    }
+    queryFn: () => listAll<Score>('/scores/', { exam: examId })
   });
 
   const exportCsv = async () => {
@@ -5,7 +5,7 @@ import { useMutation, useQuery } from '@tanstack/react-query';
 import { useEffect, useState } from 'react';
 import { Button, Form, Table } from 'react-bootstrap';
 import Layout from '../../../../components/Layout';
-import { api } from '../../../../lib/api';
+import { api, listAll } from '../../../../lib/api';
 
 interface Scan {
   id: number;
@@ -14,6 +14,7 @@ interface Scan {
   extracted_set_code: string;
   answers: string[];
   issues: string[];
+  thumbnail: string | null;
 }
 
 interface Student {
@@ -31,10 +32,12 @@ export default function ReviewPage() {
 
   const scansQuery = useQuery({
     queryKey: ['scans', examId, 'review'],
-    queryFn: async () => {
-      const res = await api.get('/scans/', { params: { exam: examId } });
-      return res.data as Scan[];
-    }
+    queryFn: () =>
+      listAll<Scan>('/scans/', {
+        exam: examId,
+        status: 'pending,needs_review',
+        fields: 'id,status,extracted_student_number,extracted_set_code,answers,issues,thumbnail'
+      })
   });
 
   useEffect(() => {
@@ -71,6 +74,7 @@ export default function ReviewPage() {
       <Table bordered hover>
         <thead>
           <tr>
+            <th></th>
             <th>ID</th>
             <th>Status</th>
             <th>Student</th>
@@ -79,21 +83,20 @@ export default function ReviewPage() {
           </tr>
         </thead>
         <tbody>
-          {scansQuery.data
-            ?.filter((scan) => scan.status !== 'processed')
-            .map((scan) => (
-              <tr key={scan.id}>
-                <td>{scan.id}</td>
-                <td>{scan.status}</td>
-                <td>{scan.extracted_student_number}</td>
-                <td>{scan.issues.join(', ')}</td>
-                <td>
-                  <Button size="sm" onClick={() => setSelected(scan)}>
-                    Review
-                  </Button>
-                </td>
-              </tr>
-            ))}
+          {scansQuery.data?.map((scan) => (
+            <tr key={scan.id}>
+              <td>{scan.thumbnail && <img src={scan.thumbnail} alt="" loading="lazy" style={{ width: 64 }} />}</td>
+              <td>{scan.id}</td>
+              <td>{scan.status}</td>
+              <td>{scan.extracted_student_number}</td>
+              <td>{scan.issues.join(', ')}</td>
+              <td>
+                <Button size="sm" onClick={() => setSelected(scan)}>
+                  Review
+                </Button>
+              </td>
+            </tr>
+          ))}
         </tbody>
       </Table>
 
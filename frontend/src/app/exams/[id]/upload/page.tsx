@@ -5,7 +5,7 @@ import { useMutation, useQuery } from '@tanstack/react-query';
 import { useState } from 'react';
 import { Button, Form, Table } from 'react-bootstrap';
 import Layout from '../../../../components/Layout';
-import { api } from '../../../../lib/api';
+import { api, Page } from '../../../../lib/api';
 
 interface Scan {
   id: number;
@@ -23,8 +23,9 @@ export default function UploadPage() {
   const query = useQuery({
     queryKey: ['scans', examId],
     queryFn: async () => {
-      const res = await api.get('/scans/', { params: { exam: examId } });
-      return res.data as Scan[];
+      // Most recent page only; the review queue loads the full backlog.
+      const res = await api.get<Page<Scan>>('/scans/', { params: { exam: examId } });
+      return res.data.results;
     }
   });
 
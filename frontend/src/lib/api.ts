@@ -4,3 +4,20 @@ export const api = axios.create({
   baseURL: process.env.NEXT_PUBLIC_API_BASE || 'http://localhost:8000/api',
   withCredentials: false
 });
+
+export interface Page<T> {
+  next: string | null;
+  previous: string | null;
+  results: T[];
+}
+
+// Follow cursor pagination until every page of a list endpoint is loaded.
+export async function listAll<T>(url: string, params: Record<string, unknown> = {}): Promise<T[]> {
+  let res = await api.get<Page<T>>(url, { params: { page_size: 1000, ...params } });
+  const items = [...res.data.results];
+  while (res.data.next) {
+    res = await api.get<Page<T>>(res.data.next);
+    items.push(...res.data.results);
+  }
+  return items;
+}